@@ -0,0 +1,252 @@
+from collections import defaultdict
+from types import SimpleNamespace
+import argparse
+import asyncio
+import io
+import os
+import random
+import tempfile
+import time
+
+TRACKS = 10
+WEIGHTS = {
+    "submit_album": 5,
+    "create_ranking": 20,
+    "read_rankings": 50,
+    "list_albums": 20,
+    "patch_config": 5,
+}
+
+
+class StubSpotify:
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    def album(self, url: str):
+        time.sleep(self.latency)
+        number = int(url.rsplit("/", 1)[-1])
+        return {
+            "artists": [{"name": f"Spotify Artist {number}"}],
+            "name": f"Spotify Album {number}",
+            "release_date": f"{1970 + number % 50}-01-01",
+            "total_tracks": TRACKS,
+            "images": [{"url": f"https://i.scdn.co/image/{number:040x}"}],
+            "tracks": {
+                "items": [
+                    {
+                        "track_number": i,
+                        "name": f"Track {number}-{i}",
+                        "duration_ms": 240_000,
+                    }
+                    for i in range(1, TRACKS + 1)
+                ]
+            },
+        }
+
+
+class StubDiscogs:
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    def master(self, id: str):
+        time.sleep(self.latency)
+        return SimpleNamespace(
+            title=f"Discogs Album {id}",
+            year=1970 + int(id) % 50,
+            main_release=SimpleNamespace(
+                artists=[SimpleNamespace(name=f"Discogs Artist {id}")],
+                images=[{"resource_url": f"https://i.discogs.com/{id}.jpg"}],
+            ),
+            tracklist=[
+                SimpleNamespace(title=f"Track {id}-{i}", duration="4:00")
+                for i in range(1, TRACKS + 1)
+            ],
+        )
+
+
+class StubCovers:
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    def __call__(self, url: str) -> bytes:
+        from PIL import Image
+
+        time.sleep(self.latency)
+        buffer = io.BytesIO()
+        Image.new("RGB", (640, 640), (len(url) * 7 % 256, 96, 160)).save(
+            buffer, "JPEG"
+        )
+        return buffer.getvalue()
+
+
+class Traffic:
+    def __init__(self, client, usernames: list[str], seed: int):
+        self.client = client
+        self.usernames = usernames
+        self.random = random.Random(seed)
+        self.album_ids: list[int] = []
+        self.ranked: set[tuple[str, int]] = set()
+        self.next_album = 1
+        self.samples = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+
+    async def request(self, label: str, method: str, url: str, **kwargs):
+        started = time.perf_counter()
+        response = await self.client.request(method, url, **kwargs)
+        self.samples[label].append(time.perf_counter() - started)
+        self.statuses[label][response.status_code] += 1
+        return response
+
+    async def submit_album(self):
+        number = self.next_album
+        self.next_album += 1
+        if number % 2:
+            album = {
+                "source": "spotify",
+                "url": f"https://open.spotify.com/album/{number}",
+            }
+        else:
+            album = {
+                "source": "discogs",
+                "url": f"https://www.discogs.com/master/{number}",
+            }
+        album["username"] = self.random.choice(self.usernames)
+        response = await self.request("POST /albums/", "POST", "/albums/", json=album)
+        if response.status_code == 200:
+            self.album_ids.append(response.json()["id"])
+
+    async def create_ranking(self):
+        album_id = self.random.choice(self.album_ids)
+        username = self.random.choice(self.usernames)
+        placements = list(range(1, TRACKS + 1))
+        self.random.shuffle(placements)
+        ranking = {"username": username, "placements": placements}
+        if (username, album_id) in self.ranked:
+            await self.request(
+                "PATCH /albums/{id}", "PATCH", f"/albums/{album_id}", json=ranking
+            )
+            return
+        self.ranked.add((username, album_id))
+        await self.request(
+            "POST /albums/{id}", "POST", f"/albums/{album_id}", json=ranking
+        )
+
+    async def read_rankings(self):
+        album_id = self.random.choice(self.album_ids)
+        await self.request("GET /rankings/{id}", "GET", f"/rankings/{album_id}")
+
+    async def list_albums(self):
+        params = {"no_spoilers": True} if self.random.random() < 0.5 else {}
+        await self.request("GET /albums/", "GET", "/albums/", params=params)
+
+    async def patch_config(self):
+        order_number = self.random.randint(1, len(self.album_ids))
+        await self.request(
+            "PATCH /config/",
+            "PATCH",
+            "/config/",
+            json={"current_order_number": order_number},
+        )
+
+    async def worker(self, deadline: float):
+        operations = list(WEIGHTS)
+        weights = list(WEIGHTS.values())
+        while time.perf_counter() < deadline:
+            operation = self.random.choices(operations, weights)[0]
+            await getattr(self, operation)()
+
+
+def percentile(samples: list[float], fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def report(traffic: Traffic, elapsed: float):
+    print(
+        f"{'endpoint':<22}{'requests':>9}{'non-2xx':>9}{'req/s':>9}"
+        f"{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+    )
+    everything = []
+    for label in sorted(traffic.samples):
+        samples = traffic.samples[label]
+        everything += samples
+        failed = sum(
+            count
+            for status, count in traffic.statuses[label].items()
+            if not 200 <= status < 300
+        )
+        print(
+            f"{label:<22}{len(samples):>9}{failed:>9}{len(samples) / elapsed:>9.1f}"
+            f"{percentile(samples, 0.50) * 1000:>9.1f}"
+            f"{percentile(samples, 0.95) * 1000:>9.1f}"
+            f"{percentile(samples, 0.99) * 1000:>9.1f}"
+        )
+    print(
+        f"{'total':<22}{len(everything):>9}{'':>9}{len(everything) / elapsed:>9.1f}"
+        f"{percentile(everything, 0.50) * 1000:>9.1f}"
+        f"{percentile(everything, 0.95) * 1000:>9.1f}"
+        f"{percentile(everything, 0.99) * 1000:>9.1f}"
+    )
+    for label in sorted(traffic.statuses):
+        statuses = ", ".join(
+            f"{status}: {count}"
+            for status, count in sorted(traffic.statuses[label].items())
+        )
+        print(f"  {label}: {statuses}")
+
+
+async def run(args):
+    import httpx
+    from ..core import api, covers
+    from ..core.database import users
+    from ..main import app
+
+    api.sp = StubSpotify(args.provider_latency / 1000)
+    api.d = StubDiscogs(args.provider_latency / 1000)
+    covers.fetcher = StubCovers(args.provider_latency / 1000)
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://load-test"
+        ) as client:
+            traffic = Traffic(
+                client, [user["username"] for user in users], args.seed
+            )
+            await client.patch(
+                "/config/",
+                json={"submissions_open": True, "max_submissions": 1_000_000},
+            )
+            for _ in range(args.albums):
+                await traffic.submit_album()
+            traffic.samples.clear()
+            traffic.statuses.clear()
+            started = time.perf_counter()
+            deadline = started + args.duration
+            await asyncio.gather(
+                *(traffic.worker(deadline) for _ in range(args.concurrency))
+            )
+            elapsed = time.perf_counter() - started
+    print(
+        f"{args.concurrency} clients, {args.duration:g}s, "
+        f"provider latency {args.provider_latency:g} ms, "
+        f"{args.albums} seeded albums"
+    )
+    report(traffic, elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Drive mixed traffic against the app with stubbed providers."
+    )
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--provider-latency", type=float, default=150)
+    parser.add_argument("--albums", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    os.chdir(tempfile.mkdtemp())
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, ORJSONResponse
+from pydantic import TypeAdapter
+from ..core import schemas
+from ..core.database import Album
+import datetime
+import timeit
+
+
+def make_albums(count: int):
+    return [
+        Album(
+            id=i,
+            artist=f"Исполнитель {i}",
+            name=f"Album {i}",
+            release_year=1970 + i % 50,
+            duration=datetime.time(minute=i % 60, second=i % 60),
+            total_tracks=7 + i % 23,
+            round_number=1 + i // 20,
+            cover=f"https://i.scdn.co/image/{i:040x}",
+            order_number=1 + i % 20,
+        )
+        for i in range(count)
+    ]
+
+
+def make_rankings(tracks: int, users: int):
+    return [
+        {
+            "track_name": f"Трек {track}",
+            "rankings": [
+                {"username": f"user{user}", "placement": 1 + (track + user) % tracks}
+                for user in range(users)
+            ],
+            "placement": round(track * 100 / 3) / 100,
+        }
+        for track in range(tracks)
+    ]
+
+
+def legacy(payload):
+    return JSONResponse(jsonable_encoder(payload)).body
+
+
+def typed(adapter: TypeAdapter):
+    def serialize(payload):
+        content = adapter.validate_python(payload, from_attributes=True)
+        return ORJSONResponse(adapter.dump_python(content, mode="json")).body
+
+    return serialize
+
+
+def measure(serialize, payload, number: int) -> float:
+    return min(timeit.repeat(lambda: serialize(payload), number=number, repeat=5)) / number
+
+
+def main():
+    cases = [
+        ("albums x1000", make_albums(1000), list[schemas.AlbumOut], 20),
+        ("albums x10000", make_albums(10000), list[schemas.AlbumOut], 3),
+        ("rankings 30x27", make_rankings(30, 27), list[schemas.TrackRankings], 200),
+        ("rankings 300x27", make_rankings(300, 27), list[schemas.TrackRankings], 20),
+    ]
+    print(f"{'payload':<18}{'legacy ms':>12}{'typed ms':>12}{'speedup':>10}")
+    for name, payload, model, number in cases:
+        before = measure(legacy, payload, number)
+        after = measure(typed(TypeAdapter(model)), payload, number)
+        print(
+            f"{name:<18}{before * 1000:>12.2f}{after * 1000:>12.2f}"
+            f"{before / after:>9.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+# runs in a fresh interpreter so every sample pays the full import cost
+probe = """
+import asyncio, json, time
+started = time.perf_counter()
+from backend.main import app
+imported = time.perf_counter()
+
+async def lifespan():
+    entered = time.perf_counter()
+    async with app.router.lifespan_context(app):
+        ready = time.perf_counter()
+    return ready - entered, time.perf_counter() - ready
+
+startup, shutdown = asyncio.run(lifespan())
+print(json.dumps({"import": imported - started, "startup": startup, "shutdown": shutdown}))
+"""
+
+
+def sample(directory: str) -> dict:
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    output = subprocess.run(
+        [sys.executable, "-c", probe],
+        cwd=directory,
+        env={**os.environ, "PYTHONPATH": root},
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure import time and lifespan duration of the app."
+    )
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+    directory = tempfile.mkdtemp()
+    # the first run creates, migrates and seeds app.db; the rest reuse it
+    cold = sample(directory)
+    warm = [sample(directory) for _ in range(args.runs)]
+    print(f"{'phase':<12}{'cold ms':>10}{'warm p50 ms':>14}{'warm min ms':>14}")
+    for phase in ("import", "startup", "shutdown"):
+        values = [run[phase] for run in warm]
+        print(
+            f"{phase:<12}{cold[phase] * 1000:>10.1f}"
+            f"{statistics.median(values) * 1000:>14.1f}{min(values) * 1000:>14.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,28 +1,213 @@
-import spotipy
-import discogs_client
 import re
 import os
+import threading
+from dataclasses import dataclass
 from dotenv import load_dotenv
-from spotipy.oauth2 import SpotifyClientCredentials
+from concurrent.futures import ThreadPoolExecutor
+from .provider_cache import cache_get, cache_put
+from .metrics import provider_duration
+from email.utils import parsedate_to_datetime
+import asyncio
 import datetime
+import time
 
 load_dotenv()
 
 CONSUMER_KEY = os.getenv("CONSUMER_KEY")
 CONSUMER_SECRET = os.getenv("CONSUMER_SECRET")
 USER_TOKEN = os.getenv("USER_TOKEN")
+PROVIDER_WORKERS = int(os.getenv("PROVIDER_WORKERS", "4"))
+PROVIDER_REQUEST_TIMEOUT = float(os.getenv("PROVIDER_REQUEST_TIMEOUT", "10"))
+PROVIDER_FETCH_TIMEOUT = float(os.getenv("PROVIDER_FETCH_TIMEOUT", "30"))
+PROVIDER_RATE_RETRIES = int(os.getenv("PROVIDER_RATE_RETRIES", "3"))
+SPOTIFY_RATE = float(os.getenv("SPOTIFY_RATE", "10"))
+SPOTIFY_BURST = int(os.getenv("SPOTIFY_BURST", "20"))
+# Discogs allows 60 authenticated requests per minute
+DISCOGS_RATE = float(os.getenv("DISCOGS_RATE", "1"))
+DISCOGS_BURST = int(os.getenv("DISCOGS_BURST", "5"))
 
-d = discogs_client.Client(
-    "album-ranking/1.0",
-    consumer_key=CONSUMER_KEY,
-    consumer_secret=CONSUMER_SECRET,
-    user_token=USER_TOKEN,
+
+class FetchAbandoned(Exception):
+    pass
+
+
+# set by processUrl for the fetch running on this provider thread
+fetch_state = threading.local()
+
+
+def checkAbandoned():
+    abandoned = getattr(fetch_state, "abandoned", None)
+    if abandoned is not None and abandoned.is_set():
+        raise FetchAbandoned()
+
+
+def providerSleep(seconds: float):
+    # like time.sleep, but gives up as soon as nobody waits for the fetch
+    abandoned = getattr(fetch_state, "abandoned", None)
+    if abandoned is None:
+        time.sleep(seconds)
+    elif abandoned.wait(seconds):
+        raise FetchAbandoned()
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now >= self._paused_until:
+                    elapsed = max(0.0, now - self._updated)
+                    self._tokens = min(
+                        self.capacity, self._tokens + elapsed * self.rate
+                    )
+                    self._updated = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait = (1 - self._tokens) / self.rate
+                else:
+                    wait = self._paused_until - now
+            providerSleep(wait)
+
+    def pause(self, seconds: float):
+        # nobody sends until Retry-After has passed, and the bucket refills from then
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._updated = self._paused_until
+            self._tokens = 0.0
+
+
+def retryAfter(value: str | None, attempt: int) -> float:
+    if value is None:
+        return 2.0**attempt
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        moment = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return 2.0**attempt
+    now = datetime.datetime.now(datetime.timezone.utc)
+    return max(0.0, (moment - now).total_seconds())
+
+
+def providerSession(bucket: TokenBucket):
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    class ProviderAdapter(HTTPAdapter):
+        def send(self, request, **kwargs):
+            for attempt in range(PROVIDER_RATE_RETRIES + 1):
+                checkAbandoned()
+                bucket.acquire()
+                response = super().send(request, **kwargs)
+                if response.status_code != 429:
+                    return response
+                wait = retryAfter(response.headers.get("Retry-After"), attempt)
+                bucket.pause(wait)
+                if attempt == PROVIDER_RATE_RETRIES or wait > PROVIDER_FETCH_TIMEOUT:
+                    return response
+                response.close()
+
+    # keep-alive connections are reused across provider workers
+    adapter = ProviderAdapter(pool_connections=2, pool_maxsize=PROVIDER_WORKERS)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def sharedToken(credentials):
+    # workers that find the token expired together request a single new one
+    lock = threading.Lock()
+    get_access_token = credentials.get_access_token
+
+    def locked(*args, **kwargs):
+        with lock:
+            return get_access_token(*args, **kwargs)
+
+    credentials.get_access_token = locked
+    return credentials
+
+
+# built on first use; importing spotipy and discogs_client alone costs
+# about half a second of startup
+d = None
+sp = None
+clients_lock = threading.Lock()
+
+
+def getDiscogs():
+    global d
+    with clients_lock:
+        if d is None:
+            import discogs_client
+
+            d = discogs_client.Client(
+                "album-ranking/1.0",
+                consumer_key=CONSUMER_KEY,
+                consumer_secret=CONSUMER_SECRET,
+                user_token=USER_TOKEN,
+            )
+            d.set_timeout(
+                connect=PROVIDER_REQUEST_TIMEOUT, read=PROVIDER_REQUEST_TIMEOUT
+            )
+            fetcher = d._fetcher
+            session = providerSession(TokenBucket(DISCOGS_RATE, DISCOGS_BURST))
+
+            # replaces the library's per-call requests.request and its blind 429 backoff
+            def request(method, url, data, headers, params=None):
+                return session.request(
+                    method,
+                    url,
+                    data=data,
+                    headers=headers,
+                    params=params,
+                    timeout=(fetcher.connect_timeout, fetcher.read_timeout),
+                )
+
+            fetcher.request = request
+        return d
+
+
+def getSpotify():
+    global sp
+    with clients_lock:
+        if sp is None:
+            import spotipy
+            from spotipy.cache_handler import MemoryCacheHandler
+            from spotipy.oauth2 import SpotifyClientCredentials
+
+            session = providerSession(TokenBucket(SPOTIFY_RATE, SPOTIFY_BURST))
+            credentials = SpotifyClientCredentials(
+                requests_session=session,
+                requests_timeout=PROVIDER_REQUEST_TIMEOUT,
+                cache_handler=MemoryCacheHandler(),
+            )
+            sp = spotipy.Spotify(
+                client_credentials_manager=sharedToken(credentials),
+                requests_session=session,
+                requests_timeout=PROVIDER_REQUEST_TIMEOUT,
+            )
+        return sp
+
+
+executor = ThreadPoolExecutor(
+    max_workers=PROVIDER_WORKERS, thread_name_prefix="provider"
 )
-sp = spotipy.Spotify(client_credentials_manager=SpotifyClientCredentials())
 
 
 def processSpotify(url: str):
-    album = sp.album(url)
+    album = getSpotify().album(url)
     tracklist = {}
     tracklist["artist"] = album["artists"][0]["name"]
     tracklist["name"] = album["name"]
@@ -39,10 +224,25 @@ def processSpotify(url: str):
     return tracklist
 
 
+def discogsId(url: str):
+    return re.findall(r"\/(\d+)", url)[0]
+
+
+def spotifyId(url: str):
+    match = re.search(r"album[/:]([A-Za-z0-9]+)", url)
+    return match.group(1) if match else url
+
+
+def providerKey(source: str, url: str):
+    if "discogs" in source:
+        return f"discogs:{discogsId(url)}"
+    return f"spotify:{spotifyId(url)}"
+
+
 def processDiscogs(source: str, url: str):
     tracklist = {}
-    id = re.findall(r"\/(\d+)", url)[0]
-    album = d.master(id)
+    id = discogsId(url)
+    album = getDiscogs().master(id)
     tracklist["artist"] = album.main_release.artists[0].name
     tracklist["name"] = album.title
     tracklist["release_year"] = album.year
@@ -62,7 +262,79 @@ def processDiscogs(source: str, url: str):
     return tracklist
 
 
-def processUrl(source: str, url: str):
-    if "discogs" in source:
-        return processDiscogs(source, url)
-    return processSpotify(url)
\ No newline at end of file
+def processUrl(source: str, url: str, abandoned: threading.Event | None = None):
+    fetch_state.abandoned = abandoned
+    try:
+        return fetchTracklist(source, url)
+    finally:
+        fetch_state.abandoned = None
+
+
+def fetchTracklist(source: str, url: str):
+    key = providerKey(source, url)
+    provider = key.split(":", 1)[0]
+    started = time.perf_counter()
+    tracklist = cache_get(key)
+    if tracklist is not None:
+        provider_duration.observe(
+            time.perf_counter() - started, provider, "hit", "ok"
+        )
+        return tracklist
+    try:
+        if "discogs" in source:
+            tracklist = processDiscogs(source, url)
+        else:
+            tracklist = processSpotify(url)
+    except Exception:
+        provider_duration.observe(
+            time.perf_counter() - started, provider, "miss", "error"
+        )
+        raise
+    provider_duration.observe(time.perf_counter() - started, provider, "miss", "ok")
+    cache_put(key, tracklist)
+    return tracklist
+
+
+@dataclass
+class Flight:
+    future: asyncio.Future
+    abandoned: threading.Event
+    waiters: int = 0
+
+
+inflight: dict[str, Flight] = {}
+
+
+def finishFetch(key: str, future: asyncio.Future):
+    flight = inflight.get(key)
+    if flight is not None and flight.future is future:
+        del inflight[key]
+    # retrieved here in case every waiter has already timed out
+    if not future.cancelled():
+        future.exception()
+
+
+async def fetchUrl(source: str, url: str, timeout: float = PROVIDER_FETCH_TIMEOUT):
+    # concurrent submissions of the same album share one provider call
+    key = providerKey(source, url)
+    flight = inflight.get(key)
+    if flight is None:
+        loop = asyncio.get_running_loop()
+        abandoned = threading.Event()
+        future = loop.run_in_executor(executor, processUrl, source, url, abandoned)
+        flight = inflight[key] = Flight(future, abandoned)
+        future.add_done_callback(lambda done: finishFetch(key, done))
+    flight.waiters += 1
+    try:
+        tracklist = await asyncio.wait_for(asyncio.shield(flight.future), timeout)
+    finally:
+        flight.waiters -= 1
+        if flight.waiters == 0 and not flight.future.done():
+            # the last waiter timed out or went away: a queued job never starts,
+            # a running one stops at its next rate-limit or Retry-After wait
+            flight.future.cancel()
+            flight.abandoned.set()
+            if inflight.get(key) is flight:
+                del inflight[key]
+    # callers consume the tracklist in place, so each one gets its own copy
+    return dict(tracklist)
@@ -0,0 +1,139 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Annotated
+from fastapi import Cookie, Depends, Header, HTTPException
+from sqlalchemy import select, delete
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from .database import TelegramSession, get_session, write_queue
+import asyncio
+import hashlib
+import logging
+import os
+import secrets
+import threading
+import time
+
+SESSION_CACHE_TTL = int(os.getenv("SESSION_CACHE_TTL", "300"))
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", "1024"))
+SESSION_SWEEP_INTERVAL = int(os.getenv("SESSION_SWEEP_INTERVAL", "3600"))
+SESSION_SWEEP_BATCH = int(os.getenv("SESSION_SWEEP_BATCH", "500"))
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class VerifiedSession:
+    id: str
+    telegram_id: int
+    expires_at: datetime
+
+
+class SessionCache:
+    def __init__(self, ttl: int, size: int):
+        self._lock = threading.Lock()
+        self._ttl = ttl
+        self._size = size
+        self._entries: OrderedDict[str, tuple[float, VerifiedSession]] = OrderedDict()
+
+    def get(self, token_hash: str) -> VerifiedSession | None:
+        with self._lock:
+            entry = self._entries.get(token_hash)
+            if entry is None:
+                return None
+            cached_until, verified = entry
+            if cached_until < time.monotonic() or verified.expires_at <= datetime.now():
+                del self._entries[token_hash]
+                return None
+            self._entries.move_to_end(token_hash)
+            return verified
+
+    def put(self, token_hash: str, verified: VerifiedSession):
+        with self._lock:
+            self._entries[token_hash] = (time.monotonic() + self._ttl, verified)
+            self._entries.move_to_end(token_hash)
+            while len(self._entries) > self._size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, token_hash: str | None = None):
+        with self._lock:
+            if token_hash is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(token_hash, None)
+
+
+session_cache = SessionCache(SESSION_CACHE_TTL, SESSION_CACHE_SIZE)
+
+
+def new_token() -> str:
+    return secrets.token_urlsafe(32)
+
+
+# only the hash is stored, so the sessions table cannot be replayed as credentials
+def hash_token(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+async def optional_session(
+    session: Annotated[AsyncSession, Depends(get_session)],
+    x_session_token: Annotated[str | None, Header()] = None,
+    session_token: Annotated[str | None, Cookie()] = None,
+) -> VerifiedSession | None:
+    token = x_session_token or session_token
+    if token is None:
+        return None
+    token_hash = hash_token(token)
+    verified = session_cache.get(token_hash)
+    if verified is not None:
+        return verified
+    db_session = await session.scalar(
+        select(TelegramSession).where(
+            TelegramSession.token_hash == token_hash,
+            TelegramSession.expires_at > datetime.now(),
+        )
+    )
+    if db_session is None:
+        raise HTTPException(status_code=401, detail="Сессия недействительна.")
+    verified = VerifiedSession(
+        id=db_session.id,
+        telegram_id=db_session.telegram_id,
+        expires_at=db_session.expires_at,
+    )
+    session_cache.put(token_hash, verified)
+    return verified
+
+
+async def verified_session(
+    verified: Annotated[VerifiedSession | None, Depends(optional_session)],
+) -> VerifiedSession:
+    if verified is None:
+        raise HTTPException(status_code=401, detail="Сессия не указана.")
+    return verified
+
+
+def purge_expired_sessions(session: Session, now: datetime, batch: int) -> int:
+    expired = (
+        select(TelegramSession.id)
+        .where(TelegramSession.expires_at < now)
+        .limit(batch)
+    )
+    return session.execute(
+        delete(TelegramSession).where(TelegramSession.id.in_(expired))
+    ).rowcount
+
+
+async def sweep_expired_sessions(
+    interval: int = SESSION_SWEEP_INTERVAL, batch: int = SESSION_SWEEP_BATCH
+):
+    while True:
+        try:
+            now = datetime.now()
+            # one batch per queue turn so other writers are not held up
+            while await write_queue.run(purge_expired_sessions, now, batch) == batch:
+                await asyncio.sleep(0)
+        except SQLAlchemyError:
+            logger.exception("Не удалось удалить истёкшие сессии.")
+        await asyncio.sleep(interval)
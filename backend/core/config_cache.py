@@ -0,0 +1,63 @@
+from dataclasses import dataclass
+from datetime import time
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from .database import Config
+import threading
+
+
+@dataclass(frozen=True)
+class ConfigSnapshot:
+    id: int
+    current_round: int
+    current_order_number: int
+    max_submissions: int
+    submissions_open: bool
+    max_duration: time
+    max_tracks: int
+    min_tracks: int
+
+
+class ConfigCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot: ConfigSnapshot | None = None
+        self._version = 0
+
+    @property
+    def version(self) -> int:
+        with self._lock:
+            return self._version
+
+    async def get(self, session: AsyncSession) -> ConfigSnapshot | None:
+        with self._lock:
+            if self._snapshot is not None:
+                return self._snapshot
+        db_config = await session.scalar(select(Config).limit(1))
+        if db_config is None:
+            return None
+        return self.refresh(db_config)
+
+    def refresh(self, db_config: Config) -> ConfigSnapshot:
+        snapshot = ConfigSnapshot(
+            id=db_config.id,
+            current_round=db_config.current_round,
+            current_order_number=db_config.current_order_number,
+            max_submissions=db_config.max_submissions,
+            submissions_open=db_config.submissions_open,
+            max_duration=db_config.max_duration,
+            max_tracks=db_config.max_tracks,
+            min_tracks=db_config.min_tracks,
+        )
+        with self._lock:
+            self._snapshot = snapshot
+            self._version += 1
+        return snapshot
+
+    def invalidate(self):
+        with self._lock:
+            self._snapshot = None
+            self._version += 1
+
+
+config_cache = ConfigCache()
@@ -0,0 +1,82 @@
+from concurrent.futures import ProcessPoolExecutor
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+from .database import Album, write_queue
+from .thumbnails import make_thumbnails
+from .versions import resource_versions
+import asyncio
+import logging
+import multiprocessing
+import os
+
+COVERS_DIR = os.getenv("COVERS_DIR", os.path.join(os.getcwd(), "covers"))
+COVERS_BASE_URL = os.getenv("COVERS_BASE_URL", "http://127.0.0.1:8000")
+COVER_SIZES = (64, 160, 300, 640)
+COVER_WORKERS = int(os.getenv("COVER_WORKERS", "2"))
+COVER_FETCH_TIMEOUT = float(os.getenv("COVER_FETCH_TIMEOUT", "10"))
+COVER_MAX_AGE = 60 * 60 * 24 * 365
+
+logger = logging.getLogger(__name__)
+
+
+def fetch_cover(url: str) -> bytes:
+    import requests
+
+    response = requests.get(url, timeout=COVER_FETCH_TIMEOUT)
+    response.raise_for_status()
+    return response.content
+
+
+# replaced with a local stub by the benchmarks and scripts
+fetcher = fetch_cover
+
+_pool: ProcessPoolExecutor | None = None
+
+
+def process_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn, not fork: the parent runs an event loop and database threads
+        _pool = ProcessPoolExecutor(
+            max_workers=COVER_WORKERS, mp_context=multiprocessing.get_context("spawn")
+        )
+    return _pool
+
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(cancel_futures=True)
+        _pool = None
+
+
+def cover_path(album_id: int, size: int) -> str:
+    return os.path.join(COVERS_DIR, str(album_id), f"{size}.jpg")
+
+
+def cover_url(album_id: int, size: int) -> str:
+    return f"{COVERS_BASE_URL}/covers/{album_id}/{size}"
+
+
+def mark_cached(session: Session, album_id: int):
+    session.execute(update(Album).where(Album.id == album_id).values(cover_cached=True))
+
+
+async def cache_cover(album_id: int, url: str):
+    loop = asyncio.get_running_loop()
+    if not all(os.path.exists(cover_path(album_id, size)) for size in COVER_SIZES):
+        try:
+            image = await loop.run_in_executor(None, fetcher, url)
+            await loop.run_in_executor(
+                process_pool(),
+                make_thumbnails,
+                image,
+                os.path.join(COVERS_DIR, str(album_id)),
+                COVER_SIZES,
+            )
+        except Exception:
+            # the album keeps pointing at the remote cover
+            logger.exception("Не удалось сохранить обложку альбома %s.", album_id)
+            return
+    await write_queue.run(mark_cached, album_id)
+    resource_versions.bump("albums")
@@ -5,11 +5,13 @@ from sqlalchemy import (
     Integer,
     Boolean,
     UniqueConstraint,
+    Index,
     ForeignKey,
     Time,
     DateTime,
 )
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, select, insert
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import (
     DeclarativeBase,
     Mapped,
@@ -19,6 +21,9 @@ from sqlalchemy.orm import (
     scoped_session,
     relationship,
 )
+from .migrations import run_migrations
+from concurrent.futures import Future
+import asyncio
 import os
 import uuid
 
@@ -61,8 +66,11 @@ users = [
 class TelegramSession(Base):
     __tablename__ = "sessions"
 
-    id: Mapped[str] = mapped_column(primary_key=True, default=str(uuid.uuid4()))
-    telegram_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
+    id: Mapped[str] = mapped_column(
+        primary_key=True, default=lambda: str(uuid.uuid4())
+    )
+    telegram_id: Mapped[int] = mapped_column(ForeignKey("users.id"), index=True)
+    token_hash: Mapped[str] = mapped_column(unique=True, index=True)
     expires_at: Mapped[datetime] = mapped_column(index=True)
 
 
@@ -93,7 +101,7 @@ class UserAlbumSubmission(Base):
     __tablename__ = "user_album_submissions"
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
-    username: Mapped[str] = mapped_column()
+    username: Mapped[str] = mapped_column(index=True)
     album_id: Mapped[int] = mapped_column(ForeignKey("albums.id"))
 
 
@@ -102,16 +110,18 @@ class Album(Base):
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     artist: Mapped[str] = mapped_column()
-    name: Mapped[str] = mapped_column()
-    release_year: Mapped[int] = mapped_column()
+    name: Mapped[str] = mapped_column(index=True)
+    release_year: Mapped[int] = mapped_column(index=True)
     duration: Mapped[time] = mapped_column()
     total_tracks: Mapped[int] = mapped_column()
     round_number: Mapped[int] = mapped_column()
     cover: Mapped[str] = mapped_column()
     order_number: Mapped[int | None] = mapped_column()
+    cover_cached: Mapped[bool] = mapped_column(default=False)
 
     __table_args__ = (
         UniqueConstraint("round_number", "order_number", name="uix_round_order"),
+        Index("ix_albums_artist_name", "artist", "name"),
     )
 
     tracks: Mapped["Track"] = relationship(
@@ -124,7 +134,7 @@ class Track(Base):
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     track_name: Mapped[str] = mapped_column()
-    album_id: Mapped[int] = mapped_column(ForeignKey("albums.id"))
+    album_id: Mapped[int] = mapped_column(ForeignKey("albums.id"), index=True)
 
     album: Mapped["Album"] = relationship(back_populates="tracks")
     rankings: Mapped["Ranking"] = relationship(
@@ -137,51 +147,153 @@ class Ranking(Base):
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     username: Mapped[str] = mapped_column()
-    track_id: Mapped[int] = mapped_column(ForeignKey("tracks.id"))
+    track_id: Mapped[int] = mapped_column(ForeignKey("tracks.id"), index=True)
     placement: Mapped[int] = mapped_column()
     track: Mapped["Track"] = relationship(back_populates="rankings")
 
     __table_args__ = (UniqueConstraint("username", "track_id", name="uix_user_track"),)
 
 
+class TrackRankingAggregate(Base):
+    __tablename__ = "track_ranking_aggregates"
+
+    track_id: Mapped[int] = mapped_column(ForeignKey("tracks.id"), primary_key=True)
+    album_id: Mapped[int] = mapped_column(ForeignKey("albums.id"), index=True)
+    placement_sum: Mapped[int] = mapped_column(default=0)
+    placement_count: Mapped[int] = mapped_column(default=0)
+    min_placement: Mapped[int | None] = mapped_column()
+    max_placement: Mapped[int | None] = mapped_column()
+
+
+class RoundSnapshot(Base):
+    __tablename__ = "round_snapshots"
+
+    album_id: Mapped[int] = mapped_column(ForeignKey("albums.id"), primary_key=True)
+    round_number: Mapped[int] = mapped_column(index=True)
+    order_number: Mapped[int | None] = mapped_column()
+    payload: Mapped[str] = mapped_column()
+    created_at: Mapped[datetime] = mapped_column()
+
+
+class ProviderCacheEntry(Base):
+    __tablename__ = "provider_cache"
+
+    key: Mapped[str] = mapped_column(primary_key=True)
+    payload: Mapped[str] = mapped_column()
+    created_at: Mapped[datetime] = mapped_column()
+    accessed_at: Mapped[datetime] = mapped_column(index=True)
+
+
 db_filename = "app.db"
 db_path = os.path.join(os.getcwd(), db_filename)
 
+engine_profile = {
+    "journal_mode": os.getenv("DB_JOURNAL_MODE", "WAL"),
+    "synchronous": os.getenv("DB_SYNCHRONOUS", "NORMAL"),
+    "busy_timeout": int(os.getenv("DB_BUSY_TIMEOUT", "5000")),
+    "cache_size": int(os.getenv("DB_CACHE_SIZE", "-16000")),
+    "mmap_size": int(os.getenv("DB_MMAP_SIZE", str(128 * 1024 * 1024))),
+    "pool_size": int(os.getenv("DB_POOL_SIZE", "5")),
+    "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "10")),
+}
+pragmas = ("journal_mode", "synchronous", "busy_timeout", "cache_size", "mmap_size")
+
 engine = create_engine(
     f"sqlite:///{db_path}",
     echo=False,
     connect_args={"check_same_thread": False},
+    pool_size=engine_profile["pool_size"],
+    max_overflow=engine_profile["max_overflow"],
 )
+
+
+async_engine = create_async_engine(
+    f"sqlite+aiosqlite:///{db_path}",
+    echo=False,
+    pool_size=engine_profile["pool_size"],
+    max_overflow=engine_profile["max_overflow"],
+)
+
+
+@event.listens_for(engine, "connect")
+@event.listens_for(async_engine.sync_engine, "connect")
+def apply_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for pragma in pragmas:
+        cursor.execute(f"PRAGMA {pragma}={engine_profile[pragma]}")
+    cursor.close()
+
+
 SessionLocal = sessionmaker(bind=engine, autocommit=False, autoflush=False)
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine, autoflush=False, expire_on_commit=False
+)
+
+
+class WriteQueue:
+    def __init__(self):
+        self._lock = asyncio.Lock()
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+
+    def stop(self):
+        self._loop = None
+
+    async def run(self, fn, *args):
+        async with self._lock:
+            async with AsyncSessionLocal() as session:
+                result = await session.run_sync(fn, *args)
+                await session.commit()
+                return result
+
+    def submit(self, fn, *args) -> Future:
+        if self._loop is not None:
+            return asyncio.run_coroutine_threadsafe(self.run(fn, *args), self._loop)
+        # outside the running app (scripts), write through the sync engine
+        future = Future()
+        with SessionLocal(expire_on_commit=False) as session:
+            try:
+                result = fn(session, *args)
+                session.commit()
+                future.set_result(result)
+            except Exception as e:
+                future.set_exception(e)
+        return future
 
 
-def get_session():
-    session = SessionLocal()
-    try:
+write_queue = WriteQueue()
+
+
+async def get_session():
+    async with AsyncSessionLocal() as session:
         yield session
-    finally:
-        session.close()
 
 
 def create_db_and_tables():
     Base.metadata.create_all(bind=engine)
+    with engine.begin() as connection:
+        run_migrations(connection)
     with SessionLocal() as session:
-        if session.query(Config).first() is None:
-            db_config = Config(id=1)
-            session.add(db_config)
-            session.commit()
-            session.refresh(db_config)
-        for user in users:
-            if (
-                session.query(User).where(User.id == user["telegram_id"]).first()
-                is None
-            ):
-                db_user = User(
-                    id=user["telegram_id"],
-                    username=user["username"],
-                    admin_rights=user["admin_rights"],
+        if session.scalar(select(Config.id).limit(1)) is None:
+            session.add(Config(id=1))
+        seeded = set(
+            session.scalars(
+                select(User.id).where(
+                    User.id.in_([user["telegram_id"] for user in users])
                 )
-                session.add(db_user)
-                session.commit()
-                session.refresh(db_user)
-        session.close()
+            )
+        )
+        missing = [
+            {
+                "id": user["telegram_id"],
+                "username": user["username"],
+                "admin_rights": user["admin_rights"],
+            }
+            for user in users
+            if user["telegram_id"] not in seeded
+        ]
+        if len(missing) != 0:
+            session.execute(insert(User), missing)
+        session.commit()
@@ -0,0 +1,79 @@
+from collections import deque
+import asyncio
+import orjson
+import os
+
+EVENTS_QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", "100"))
+EVENTS_REPLAY_SIZE = int(os.getenv("EVENTS_REPLAY_SIZE", "256"))
+EVENTS_KEEPALIVE = float(os.getenv("EVENTS_KEEPALIVE", "15"))
+
+
+def encode(event_id: int, event: str, data: dict) -> bytes:
+    return (
+        f"id: {event_id}\nevent: {event}\ndata: ".encode()
+        + orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+        + b"\n\n"
+    )
+
+
+class EventHub:
+    def __init__(self):
+        self._subscribers: set[asyncio.Queue] = set()
+        self._replay: deque[tuple[int, bytes]] = deque(maxlen=EVENTS_REPLAY_SIZE)
+        self._last_id = 0
+
+    def publish(self, event: str, data: dict):
+        self._last_id += 1
+        message = encode(self._last_id, event, data)
+        self._replay.append((self._last_id, message))
+        for queue in list(self._subscribers):
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                # a client that cannot keep up is dropped and resyncs on reconnect
+                self._subscribers.discard(queue)
+                queue.get_nowait()
+                queue.put_nowait(None)
+
+    def subscribe(self, last_event_id: int | None = None) -> asyncio.Queue:
+        backlog = []
+        if last_event_id is not None:
+            backlog = [
+                message
+                for event_id, message in self._replay
+                if event_id > last_event_id
+            ]
+        queue = asyncio.Queue(maxsize=EVENTS_QUEUE_SIZE + len(backlog))
+        for message in backlog:
+            queue.put_nowait(message)
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._subscribers.discard(queue)
+
+    def close(self):
+        for queue in list(self._subscribers):
+            self._subscribers.discard(queue)
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(None)
+
+    async def stream(self, last_event_id: int | None = None):
+        queue = self.subscribe(last_event_id)
+        try:
+            yield b"retry: 3000\n\n"
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), EVENTS_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield b": keepalive\n\n"
+                    continue
+                if message is None:
+                    return
+                yield message
+        finally:
+            self.unsubscribe(queue)
+
+
+event_hub = EventHub()
@@ -0,0 +1,65 @@
+from sqlalchemy import select
+from .database import AsyncSessionLocal, Album, Track, Ranking
+import csv
+import io
+import orjson
+import os
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv; charset=utf-8"}
+
+columns = (
+    "round_number",
+    "order_number",
+    "album_id",
+    "artist",
+    "album",
+    "release_year",
+    "track_id",
+    "track_name",
+    "username",
+    "placement",
+)
+
+
+def export_query():
+    # walks albums by id, then the album_id and track_id indexes, so no sort step
+    return (
+        select(
+            Album.round_number,
+            Album.order_number,
+            Album.id,
+            Album.artist,
+            Album.name,
+            Album.release_year,
+            Track.id,
+            Track.track_name,
+            Ranking.username,
+            Ranking.placement,
+        )
+        .outerjoin(Track, Track.album_id == Album.id)
+        .outerjoin(Ranking, Ranking.track_id == Track.id)
+        .order_by(Album.id, Track.id, Ranking.id)
+        .execution_options(yield_per=EXPORT_BATCH_SIZE)
+    )
+
+
+def ndjson_chunk(rows) -> bytes:
+    return b"".join(orjson.dumps(dict(zip(columns, row))) + b"\n" for row in rows)
+
+
+def csv_chunk(rows) -> bytes:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue().encode()
+
+
+async def export_rows(format: str):
+    encode = ndjson_chunk if format == "ndjson" else csv_chunk
+    if format == "csv":
+        yield csv_chunk([columns])
+    # the request's session is closed before the body streams, so open our own
+    async with AsyncSessionLocal() as session:
+        result = await session.stream(export_query())
+        async for partition in result.partitions():
+            yield encode(partition)
@@ -0,0 +1,205 @@
+from contextvars import ContextVar
+from dataclasses import dataclass
+from sqlalchemy import event
+from .database import engine, async_engine
+import os
+import threading
+import time
+
+METRICS_DEBUG_HEADERS = os.getenv("METRICS_DEBUG_HEADERS", "0") == "1"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+
+def escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, amount: float, *labels):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} counter",
+        ]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(
+                    f"{self.name}{format_labels(self.labelnames, labels)} {value}"
+                )
+        return lines
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple = (),
+        buckets: tuple = LATENCY_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        # labels -> [per-bucket counts, sum, count]
+        self._values: dict[tuple, list] = {}
+
+    def observe(self, value: float, *labels):
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                series = self._values[labels] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        with self._lock:
+            for labels, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket in zip(self.buckets, counts):
+                    cumulative += bucket
+                    le = format_labels(self.labelnames, labels, f'le="{bound}"')
+                    lines.append(f"{self.name}_bucket{le} {cumulative}")
+                le = format_labels(self.labelnames, labels, 'le="+Inf"')
+                lines.append(f"{self.name}_bucket{le} {count}")
+                plain = format_labels(self.labelnames, labels)
+                lines.append(f"{self.name}_sum{plain} {total}")
+                lines.append(f"{self.name}_count{plain} {count}")
+        return lines
+
+
+request_duration = Histogram(
+    "http_request_duration_seconds",
+    "Time spent handling a request.",
+    ("method", "route", "status"),
+)
+request_queries = Histogram(
+    "db_queries_per_request",
+    "SQL statements executed while handling a request.",
+    ("method", "route"),
+    QUERY_BUCKETS,
+)
+request_db_time = Counter(
+    "db_query_seconds_total",
+    "Time spent executing SQL statements, by route.",
+    ("method", "route"),
+)
+provider_duration = Histogram(
+    "provider_request_duration_seconds",
+    "Time spent resolving an album through a metadata provider.",
+    ("source", "cache", "outcome"),
+)
+registry = (request_duration, request_queries, request_db_time, provider_duration)
+
+
+@dataclass
+class RequestStats:
+    queries: int = 0
+    db_time: float = 0.0
+
+
+request_stats: ContextVar[RequestStats | None] = ContextVar(
+    "request_stats", default=None
+)
+
+
+@event.listens_for(engine, "before_cursor_execute")
+@event.listens_for(async_engine.sync_engine, "before_cursor_execute")
+def start_query(conn, cursor, statement, parameters, context, executemany):
+    # kept on the execution context, which is dropped with the statement even
+    # when it raises; a per-connection list outlived failed statements
+    if context is not None:
+        context.metrics_started = time.perf_counter()
+
+
+@event.listens_for(engine, "after_cursor_execute")
+@event.listens_for(async_engine.sync_engine, "after_cursor_execute")
+def finish_query(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "metrics_started", None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    stats = request_stats.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_time += elapsed
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        stats = RequestStats()
+        token = request_stats.set(stats)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_stats(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if METRICS_DEBUG_HEADERS:
+                    elapsed = time.perf_counter() - started
+                    message["headers"] = [
+                        *message.get("headers", []),
+                        (b"x-query-count", str(stats.queries).encode()),
+                        (
+                            b"server-timing",
+                            f"db;dur={stats.db_time * 1000:.2f}, "
+                            f"total;dur={elapsed * 1000:.2f}".encode(),
+                        ),
+                    ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_stats)
+        finally:
+            request_stats.reset(token)
+            route = scope.get("route")
+            # unmatched paths share one label to keep cardinality bounded
+            path = route.path if route is not None else "unmatched"
+            method = scope["method"]
+            request_duration.observe(
+                time.perf_counter() - started, method, path, status
+            )
+            request_queries.observe(stats.queries, method, path)
+            request_db_time.inc(stats.db_time, method, path)
+
+
+def render() -> str:
+    lines = []
+    for metric in registry:
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,93 @@
+from sqlalchemy import Connection
+
+# Each entry is applied once to databases whose PRAGMA user_version is
+# lower than its version. New databases get the same schema from the
+# models via create_all, so statements must be idempotent.
+
+
+def add_column(table: str, column: str, definition: str):
+    def migrate(connection: Connection):
+        columns = connection.exec_driver_sql(f"PRAGMA table_info({table})").all()
+        if column not in {row[1] for row in columns}:
+            connection.exec_driver_sql(
+                f"ALTER TABLE {table} ADD COLUMN {column} {definition}"
+            )
+
+    return migrate
+
+
+migrations = [
+    (
+        1,
+        [
+            "CREATE INDEX IF NOT EXISTS ix_rankings_track_id ON rankings (track_id)",
+            "CREATE INDEX IF NOT EXISTS ix_tracks_album_id ON tracks (album_id)",
+            "CREATE INDEX IF NOT EXISTS ix_albums_artist_name ON albums (artist, name)",
+            "CREATE INDEX IF NOT EXISTS ix_albums_name ON albums (name)",
+            "CREATE INDEX IF NOT EXISTS ix_albums_release_year ON albums (release_year)",
+            "CREATE INDEX IF NOT EXISTS ix_user_album_submissions_username "
+            "ON user_album_submissions (username)",
+            "CREATE INDEX IF NOT EXISTS ix_sessions_telegram_id ON sessions (telegram_id)",
+        ],
+    ),
+    (
+        2,
+        [
+            "INSERT OR REPLACE INTO track_ranking_aggregates "
+            "(track_id, album_id, placement_sum, placement_count, "
+            "min_placement, max_placement) "
+            "SELECT rankings.track_id, tracks.album_id, sum(rankings.placement), "
+            "count(rankings.id), min(rankings.placement), max(rankings.placement) "
+            "FROM rankings JOIN tracks ON tracks.id = rankings.track_id "
+            "GROUP BY rankings.track_id, tracks.album_id",
+        ],
+    ),
+    (3, [add_column("albums", "cover_cached", "BOOLEAN NOT NULL DEFAULT 0")]),
+    (
+        4,
+        [
+            "CREATE VIRTUAL TABLE IF NOT EXISTS album_search "
+            "USING fts5(artist, name, tracks, "
+            "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')",
+            "INSERT INTO album_search (album_search, rank) "
+            "VALUES ('rank', 'bm25(5.0, 10.0, 1.0)')",
+            "DELETE FROM album_search",
+            "INSERT INTO album_search (rowid, artist, name, tracks) "
+            "SELECT albums.id, "
+            "replace(replace(albums.artist, 'ё', 'е'), 'Ё', 'Е'), "
+            "replace(replace(albums.name, 'ё', 'е'), 'Ё', 'Е'), "
+            "replace(replace(coalesce(group_concat(tracks.track_name, char(10)), ''), "
+            "'ё', 'е'), 'Ё', 'Е') "
+            "FROM albums LEFT JOIN tracks ON tracks.album_id = albums.id "
+            "GROUP BY albums.id",
+        ],
+    ),
+    (
+        5,
+        [
+            # session ids used to be the credential and were readable by anyone,
+            # so every existing session has to sign in again
+            "DELETE FROM sessions",
+            add_column("sessions", "token_hash", "VARCHAR NOT NULL DEFAULT ''"),
+            "CREATE UNIQUE INDEX IF NOT EXISTS ix_sessions_token_hash "
+            "ON sessions (token_hash)",
+        ],
+    ),
+]
+
+
+def schema_version(connection: Connection) -> int:
+    return connection.exec_driver_sql("PRAGMA user_version").scalar()
+
+
+def run_migrations(connection: Connection):
+    current = schema_version(connection)
+    for version, statements in migrations:
+        if version <= current:
+            continue
+        for statement in statements:
+            if callable(statement):
+                statement(connection)
+            else:
+                connection.exec_driver_sql(statement)
+        connection.exec_driver_sql(f"PRAGMA user_version = {version}")
@@ -0,0 +1,32 @@
+from fastapi import HTTPException
+import base64
+import binascii
+import json
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+
+def encode_cursor(*values: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, size: int) -> list[int]:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (binascii.Error, ValueError):
+        values = None
+    if (
+        not isinstance(values, list)
+        or len(values) != size
+        or not all(isinstance(value, int) for value in values)
+    ):
+        raise HTTPException(status_code=400, detail="Неверный курсор.")
+    return values
+
+
+def paginate(rows: list, limit: int, key) -> dict:
+    return {
+        "items": rows[:limit],
+        "next_cursor": encode_cursor(*key(rows[limit - 1])) if len(rows) > limit else None,
+    }
@@ -0,0 +1,96 @@
+from datetime import datetime, time, timedelta
+from sqlalchemy import select, update, delete, func, true
+from sqlalchemy.orm import Session
+from .database import SessionLocal, ProviderCacheEntry, write_queue
+import json
+import os
+import threading
+
+PROVIDER_CACHE_TTL = int(os.getenv("PROVIDER_CACHE_TTL", str(7 * 24 * 60 * 60)))
+PROVIDER_CACHE_SIZE = int(os.getenv("PROVIDER_CACHE_SIZE", "500"))
+
+counters = {"hits": 0, "misses": 0}
+counters_lock = threading.Lock()
+
+
+def count(name: str):
+    with counters_lock:
+        counters[name] += 1
+
+
+def encode(tracklist: dict) -> str:
+    return json.dumps(
+        [
+            [key, value.isoformat() if key == "duration" else value]
+            for key, value in tracklist.items()
+        ],
+        ensure_ascii=False,
+    )
+
+
+def decode(payload: str) -> dict:
+    return {
+        key: time.fromisoformat(value) if key == "duration" else value
+        for key, value in json.loads(payload)
+    }
+
+
+def touch(session: Session, key: str, accessed_at: datetime):
+    session.execute(
+        update(ProviderCacheEntry)
+        .where(ProviderCacheEntry.key == key)
+        .values(accessed_at=accessed_at)
+    )
+
+
+def store(session: Session, key: str, payload: str, created_at: datetime):
+    session.merge(
+        ProviderCacheEntry(
+            key=key, payload=payload, created_at=created_at, accessed_at=created_at
+        )
+    )
+    session.flush()
+    evicted = (
+        select(ProviderCacheEntry.key)
+        .order_by(ProviderCacheEntry.accessed_at.desc())
+        .offset(PROVIDER_CACHE_SIZE)
+    )
+    session.execute(
+        delete(ProviderCacheEntry).where(ProviderCacheEntry.key.in_(evicted))
+    )
+
+
+def purge_entries(session: Session, key: str | None = None) -> int:
+    return session.execute(
+        delete(ProviderCacheEntry).where(
+            (ProviderCacheEntry.key == key) if key is not None else true()
+        )
+    ).rowcount
+
+
+def cache_get(key: str) -> dict | None:
+    now = datetime.now()
+    with SessionLocal() as session:
+        entry = session.get(ProviderCacheEntry, key)
+        if entry is not None and entry.created_at < now - timedelta(
+            seconds=PROVIDER_CACHE_TTL
+        ):
+            write_queue.submit(purge_entries, key)
+            entry = None
+        if entry is None:
+            count("misses")
+            return None
+        payload = entry.payload
+    write_queue.submit(touch, key, now)
+    count("hits")
+    return decode(payload)
+
+
+def cache_put(key: str, tracklist: dict):
+    write_queue.submit(store, key, encode(tracklist), datetime.now()).result()
+
+
+def cache_stats(session: Session) -> dict:
+    entries = session.scalar(select(func.count()).select_from(ProviderCacheEntry))
+    with counters_lock:
+        return {**counters, "entries": entries}
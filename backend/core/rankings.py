@@ -0,0 +1,273 @@
+from collections import defaultdict
+from fastapi import HTTPException
+from sqlalchemy import select, delete, func
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+from .database import Album, Config, Track, Ranking, TrackRankingAggregate, User
+
+# keeps IN lists well under SQLite's bound-parameter limit
+IMPORT_CHUNK_SIZE = 5000
+
+
+def chunked(values: list, size: int = IMPORT_CHUNK_SIZE):
+    for start in range(0, len(values), size):
+        yield values[start : start + size]
+
+
+def add_to_aggregates(session: Session, album_id: int, placements: dict[int, int]):
+    # placements maps track_id -> placement of a single new ranking
+    if len(placements) == 0:
+        return
+    stmt = insert(TrackRankingAggregate).values(
+        [
+            {
+                "track_id": track_id,
+                "album_id": album_id,
+                "placement_sum": placement,
+                "placement_count": 1,
+                "min_placement": placement,
+                "max_placement": placement,
+            }
+            for track_id, placement in placements.items()
+        ]
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[TrackRankingAggregate.track_id],
+        set_={
+            "placement_sum": TrackRankingAggregate.placement_sum
+            + stmt.excluded.placement_sum,
+            "placement_count": TrackRankingAggregate.placement_count
+            + stmt.excluded.placement_count,
+            "min_placement": func.min(
+                TrackRankingAggregate.min_placement, stmt.excluded.min_placement
+            ),
+            "max_placement": func.max(
+                TrackRankingAggregate.max_placement, stmt.excluded.max_placement
+            ),
+        },
+    )
+    session.execute(stmt)
+
+
+def recompute_aggregates(session: Session, track_ids: list[int] | None = None):
+    totals = (
+        select(
+            Ranking.track_id,
+            Track.album_id,
+            func.sum(Ranking.placement),
+            func.count(Ranking.id),
+            func.min(Ranking.placement),
+            func.max(Ranking.placement),
+        )
+        .join(Track, Track.id == Ranking.track_id)
+        .group_by(Ranking.track_id, Track.album_id)
+    )
+    stale = delete(TrackRankingAggregate)
+    if track_ids is not None:
+        totals = totals.where(Ranking.track_id.in_(track_ids))
+        stale = stale.where(TrackRankingAggregate.track_id.in_(track_ids))
+    session.execute(stale)
+    session.execute(
+        insert(TrackRankingAggregate).from_select(
+            [
+                TrackRankingAggregate.track_id,
+                TrackRankingAggregate.album_id,
+                TrackRankingAggregate.placement_sum,
+                TrackRankingAggregate.placement_count,
+                TrackRankingAggregate.min_placement,
+                TrackRankingAggregate.max_placement,
+            ],
+            totals,
+        )
+    )
+
+
+def album_averages(session: Session, album_id: int) -> dict[int, float]:
+    rows = session.execute(
+        select(
+            TrackRankingAggregate.track_id,
+            TrackRankingAggregate.placement_sum,
+            TrackRankingAggregate.placement_count,
+        ).where(TrackRankingAggregate.album_id == album_id)
+    ).all()
+    return {
+        track_id: round(placement_sum / placement_count * 100) / 100
+        for track_id, placement_sum, placement_count in rows
+        if placement_count
+    }
+
+
+def album_rankings(session: Session, album_id: int):
+    rows = session.execute(
+        select(
+            Track.id,
+            Track.track_name,
+            TrackRankingAggregate.placement_sum,
+            TrackRankingAggregate.placement_count,
+            Ranking.username,
+            Ranking.placement,
+        )
+        .join(TrackRankingAggregate, TrackRankingAggregate.track_id == Track.id)
+        .join(Ranking, Ranking.track_id == Track.id)
+        .where(TrackRankingAggregate.album_id == album_id)
+        .order_by(Track.id, Ranking.id)
+    ).all()
+    db_rankings = {}
+    for track_id, track_name, placement_sum, placement_count, username, placement in rows:
+        if track_id not in db_rankings:
+            db_rankings[track_id] = {
+                "track_name": track_name,
+                "rankings": [],
+                "placement": round(placement_sum / placement_count * 100) / 100,
+            }
+        db_rankings[track_id]["rankings"].append(
+            {"username": username, "placement": placement}
+        )
+    return sorted(db_rankings.values(), key=lambda d: d["placement"])
+
+
+def closed_albums(session: Session, album_ids: list[int]) -> set[int]:
+    # albums of finished rounds are frozen in round_snapshots, so they stay as is
+    current_round = session.scalar(select(Config.current_round).limit(1))
+    if current_round is None:
+        return set()
+    closed = set()
+    for chunk in chunked(album_ids):
+        closed.update(
+            session.scalars(
+                select(Album.id).where(
+                    Album.id.in_(chunk), Album.round_number < current_round
+                )
+            )
+        )
+    return closed
+
+
+def placement_error(track_count: int, placements: list[int]) -> str | None:
+    # a ranking is a whole album: every track once, placed 1..N without repeats
+    if track_count != len(placements):
+        return "Количество позиций не равно количеству треков в альбоме."
+    if sorted(placements) != list(range(1, track_count + 1)):
+        return "Позиции должны идти от 1 до числа треков без повторов."
+    return None
+
+
+def write_rankings(
+    session: Session,
+    album_id: int,
+    username: str,
+    placements: list[int],
+    replace: bool = False,
+):
+    track_ids = session.scalars(
+        select(Track.id).where(Track.album_id == album_id).order_by(Track.id)
+    ).all()
+    if len(track_ids) == 0:
+        raise HTTPException(status_code=404, detail="Альбом не найден.")
+    if closed_albums(session, [album_id]):
+        raise HTTPException(status_code=409, detail="Раунд этого альбома закрыт.")
+    error = placement_error(len(track_ids), placements)
+    if error is not None:
+        raise HTTPException(status_code=400, detail=error)
+    rows = [
+        {"username": username, "track_id": track_id, "placement": placement}
+        for track_id, placement in zip(track_ids, placements)
+    ]
+    if replace:
+        stmt = insert(Ranking).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Ranking.username, Ranking.track_id],
+            set_={"placement": stmt.excluded.placement},
+        )
+        session.execute(stmt)
+        recompute_aggregates(session, list(track_ids))
+        return
+    if (
+        session.scalar(
+            select(Ranking.id)
+            .where(Ranking.username == username, Ranking.track_id.in_(track_ids))
+            .limit(1)
+        )
+        is not None
+    ):
+        raise HTTPException(
+            status_code=400,
+            detail="У этого пользователя уже есть оценки.",
+        )
+    session.execute(insert(Ranking), rows)
+    add_to_aggregates(session, album_id, dict(zip(track_ids, placements)))
+
+
+def import_rankings(session: Session, rows: list[dict]):
+    track_ids = list({row["track_id"] for row in rows})
+    usernames = list({row["username"] for row in rows})
+    albums = {}
+    for chunk in chunked(track_ids):
+        albums.update(
+            session.execute(
+                select(Track.id, Track.album_id).where(Track.id.in_(chunk))
+            ).all()
+        )
+    album_ids = list(set(albums.values()))
+    closed = closed_albums(session, album_ids)
+    album_tracks = defaultdict(list)
+    for chunk in chunked(album_ids):
+        for album_id, track_id in session.execute(
+            select(Track.album_id, Track.id).where(Track.album_id.in_(chunk))
+        ):
+            album_tracks[album_id].append(track_id)
+    known_users = set()
+    for chunk in chunked(usernames):
+        known_users.update(
+            session.scalars(select(User.username).where(User.username.in_(chunk)))
+        )
+    # a row-value IN walks the whole uix_user_track index, so seek by track
+    track_albums = {
+        track_id: album_id
+        for album_id, album_track_ids in album_tracks.items()
+        for track_id in album_track_ids
+    }
+    ranked = set()
+    for chunk in chunked(list(track_albums)):
+        ranked.update(
+            (username, track_albums[track_id])
+            for username, track_id in session.execute(
+                select(Ranking.username, Ranking.track_id).where(
+                    Ranking.track_id.in_(chunk)
+                )
+            )
+            if username in known_users
+        )
+    rejected = []
+    groups = defaultdict(list)
+    for number, row in enumerate(rows, start=1):
+        if row["track_id"] not in albums:
+            rejected.append({"row": number, "detail": "Трек не найден."})
+        elif albums[row["track_id"]] in closed:
+            rejected.append({"row": number, "detail": "Раунд этого альбома закрыт."})
+        elif row["username"] not in known_users:
+            rejected.append({"row": number, "detail": "Пользователь не найден."})
+        else:
+            groups[(row["username"], albums[row["track_id"]])].append((number, row))
+    # rows are accepted per user and album, only as a complete ranking
+    accepted = []
+    for (username, album_id), group in groups.items():
+        group_track_ids = sorted(row["track_id"] for _, row in group)
+        if (username, album_id) in ranked:
+            error = "У этого пользователя уже есть оценки."
+        elif group_track_ids != sorted(album_tracks[album_id]):
+            error = "Оценки должны покрывать каждый трек альбома ровно один раз."
+        else:
+            error = placement_error(
+                len(album_tracks[album_id]), [row["placement"] for _, row in group]
+            )
+        if error is not None:
+            rejected += [{"row": number, "detail": error} for number, _ in group]
+        else:
+            accepted += [row for _, row in group]
+    if len(accepted) != 0:
+        session.execute(insert(Ranking), accepted)
+        for chunk in chunked(list({row["track_id"] for row in accepted})):
+            recompute_aggregates(session, chunk)
+    album_ids = {albums[row["track_id"]] for row in accepted}
+    return len(accepted), sorted(rejected, key=lambda d: d["row"]), album_ids
@@ -1,5 +1,9 @@
-from pydantic import BaseModel, Field
-from datetime import time
+from pydantic import BaseModel, ConfigDict, Field, model_validator
+from datetime import datetime, time
+from typing import Generic, TypeVar
+from .covers import COVER_SIZES, cover_url
+
+T = TypeVar("T")
 
 
 class Album(BaseModel):
@@ -20,10 +24,6 @@ class Session(BaseModel):
     auth_date: int
     hash: str
 
-class SessionPatch(BaseModel):
-    id: str
-    auth_date: int
-
 class User(BaseModel):
     id: int
     username: str
@@ -71,3 +71,153 @@ class Config(BaseModel):
     max_duration: time = Field(default=None, examples=[time(hour=2)])
     max_tracks: int = Field(default=None, examples=[30])
     min_tracks: int = Field(default=None, examples=[7])
+
+
+class UserOut(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: int
+    username: str
+    admin_rights: bool
+
+
+class SessionOut(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    telegram_id: int
+    expires_at: datetime
+
+
+class SessionToken(SessionOut):
+    token: str
+
+
+class AlbumOut(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: int
+    artist: str
+    name: str
+    release_year: int
+    duration: time
+    total_tracks: int
+    round_number: int
+    cover: str
+    order_number: int | None
+    cover_cached: bool | None = Field(default=None, exclude=True)
+    thumbnails: dict[int, str] = Field(default_factory=dict)
+
+    @model_validator(mode="after")
+    def local_cover(self):
+        if self.cover_cached:
+            self.thumbnails = {size: cover_url(self.id, size) for size in COVER_SIZES}
+            self.cover = self.thumbnails[max(COVER_SIZES)]
+        return self
+
+
+class SearchResult(BaseModel):
+    album: AlbumOut
+    score: float
+
+
+class TrackOut(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: int
+    track_name: str
+    album_id: int
+
+
+class RankingOut(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: int
+    username: str
+    track_id: int
+    placement: int
+
+
+class UserPlacement(BaseModel):
+    username: str
+    placement: int
+
+
+class TrackRankings(BaseModel):
+    track_name: str
+    rankings: list[UserPlacement]
+    placement: float
+
+
+class RoundSummary(BaseModel):
+    round_number: int
+    albums: int
+
+
+class RoundResults(BaseModel):
+    album: AlbumOut
+    rankings: list[TrackRankings]
+
+
+class Similarity(BaseModel):
+    method: str
+    usernames: list[str]
+    matrix: list[list[float | None]]
+    albums: list[list[int]]
+
+
+class Compatibility(BaseModel):
+    username: str
+    correlation: float
+    albums: int
+
+
+class RankingRow(BaseModel):
+    username: str
+    track_id: int
+    placement: int = Field(ge=1)
+
+
+class RankingImportReject(BaseModel):
+    row: int
+    detail: str
+
+
+class RankingImportResult(BaseModel):
+    inserted: int
+    rejected: list[RankingImportReject]
+
+
+class ConfigOut(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: int
+    current_round: int
+    current_order_number: int
+    max_submissions: int
+    submissions_open: bool
+    max_duration: time
+    max_tracks: int
+    min_tracks: int
+
+
+class Page(BaseModel, Generic[T]):
+    items: list[T]
+    next_cursor: str | None
+
+
+class AlbumImportResult(BaseModel):
+    url: str
+    success: bool
+    status_code: int
+    detail: str | None = None
+    album: AlbumOut | None = None
+
+
+class ProviderCacheStats(BaseModel):
+    hits: int
+    misses: int
+    entries: int
+
+
+class PurgeResult(BaseModel):
+    purged: int
@@ -0,0 +1,60 @@
+from fastapi import HTTPException
+from sqlalchemy import select, text
+from sqlalchemy.orm import Session
+from .database import Album
+import re
+
+MAX_QUERY_TERMS = 10
+
+# unicode61 keeps ё apart from е, while people mostly type е
+folds = str.maketrans({"ё": "е", "Ё": "Е"})
+
+
+def fold(value: str) -> str:
+    return value.translate(folds)
+
+
+def index_album(
+    session: Session, album_id: int, artist: str, name: str, track_names: list
+):
+    session.execute(
+        text(
+            "INSERT OR REPLACE INTO album_search (rowid, artist, name, tracks) "
+            "VALUES (:album_id, :artist, :name, :tracks)"
+        ),
+        {
+            "album_id": album_id,
+            "artist": fold(artist),
+            "name": fold(name),
+            "tracks": fold("\n".join(track_names)),
+        },
+    )
+
+
+def match_expression(query: str) -> str:
+    terms = re.findall(r"\w+", fold(query))[:MAX_QUERY_TERMS]
+    if len(terms) == 0:
+        raise HTTPException(status_code=400, detail="Пустой поисковый запрос.")
+    # quoting keeps FTS5 operators in user input literal; * makes each a prefix
+    return " ".join(f'"{term}"*' for term in terms)
+
+
+def search_albums(session: Session, query: str, limit: int) -> list[dict]:
+    matches = session.execute(
+        text(
+            "SELECT rowid, rank FROM album_search WHERE album_search MATCH :query "
+            "ORDER BY rank LIMIT :limit"
+        ),
+        {"query": match_expression(query), "limit": limit},
+    ).all()
+    albums = {
+        album.id: album
+        for album in session.scalars(
+            select(Album).where(Album.id.in_([album_id for album_id, _ in matches]))
+        )
+    }
+    return [
+        {"album": albums[album_id], "score": -rank}
+        for album_id, rank in matches
+        if album_id in albums
+    ]
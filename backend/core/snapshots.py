@@ -0,0 +1,120 @@
+from datetime import datetime
+from sqlalchemy import select, delete, func, insert
+from sqlalchemy.orm import Session
+from .database import (
+    Album,
+    Config,
+    Track,
+    Ranking,
+    TrackRankingAggregate,
+    RoundSnapshot,
+)
+import orjson
+
+
+def snapshot_rounds(session: Session) -> int:
+    current_round = session.scalar(select(Config.current_round).limit(1))
+    if current_round is None:
+        return 0
+    # rounds that were reopened are live again and will be frozen on close
+    session.execute(
+        delete(RoundSnapshot).where(RoundSnapshot.round_number >= current_round)
+    )
+    albums = session.execute(
+        select(Album.id, Album.round_number, Album.order_number).where(
+            Album.round_number < current_round,
+            Album.id.not_in(select(RoundSnapshot.album_id)),
+        )
+    ).all()
+    if len(albums) == 0:
+        return 0
+    rows = session.execute(
+        select(
+            Track.album_id,
+            Track.id,
+            Track.track_name,
+            TrackRankingAggregate.placement_sum,
+            TrackRankingAggregate.placement_count,
+            Ranking.username,
+            Ranking.placement,
+        )
+        .outerjoin(TrackRankingAggregate, TrackRankingAggregate.track_id == Track.id)
+        .outerjoin(Ranking, Ranking.track_id == Track.id)
+        .where(Track.album_id.in_([album.id for album in albums]))
+        .order_by(Track.album_id, Track.id, Ranking.id)
+    ).all()
+    payloads = {
+        album.id: {"tracks": [], "placements": [], "rankings": {}} for album in albums
+    }
+    positions = {}
+    for album_id, track_id, track_name, total, count, username, placement in rows:
+        payload = payloads[album_id]
+        if track_id not in positions:
+            positions[track_id] = len(payload["tracks"])
+            payload["tracks"].append(track_name)
+            payload["placements"].append(
+                round(total / count * 100) / 100 if count else None
+            )
+        if username is not None:
+            vector = payload["rankings"].setdefault(username, [])
+            vector.extend([None] * (positions[track_id] + 1 - len(vector)))
+            vector[positions[track_id]] = placement
+    created_at = datetime.now()
+    session.execute(
+        insert(RoundSnapshot),
+        [
+            {
+                "album_id": album.id,
+                "round_number": album.round_number,
+                "order_number": album.order_number,
+                "payload": orjson.dumps(payloads[album.id]).decode(),
+                "created_at": created_at,
+            }
+            for album in albums
+        ],
+    )
+    return len(albums)
+
+
+def snapshot_rankings(payload: dict) -> list[dict]:
+    results = []
+    for position, track_name in enumerate(payload["tracks"]):
+        if payload["placements"][position] is None:
+            continue
+        results.append(
+            {
+                "track_name": track_name,
+                "rankings": [
+                    {"username": username, "placement": vector[position]}
+                    for username, vector in payload["rankings"].items()
+                    if position < len(vector) and vector[position] is not None
+                ],
+                "placement": payload["placements"][position],
+            }
+        )
+    return sorted(results, key=lambda d: d["placement"])
+
+
+def closed_rounds(session: Session) -> list[dict]:
+    rows = session.execute(
+        select(RoundSnapshot.round_number, func.count(RoundSnapshot.album_id))
+        .group_by(RoundSnapshot.round_number)
+        .order_by(RoundSnapshot.round_number)
+    ).all()
+    return [
+        {"round_number": round_number, "albums": albums}
+        for round_number, albums in rows
+    ]
+
+
+def round_results(session: Session, round_number: int) -> list[dict]:
+    rows = session.execute(
+        select(Album, RoundSnapshot.payload)
+        .join(RoundSnapshot, RoundSnapshot.album_id == Album.id)
+        .where(RoundSnapshot.round_number == round_number)
+        .order_by(RoundSnapshot.order_number)
+    ).all()
+    return [
+        {"album": album, "rankings": snapshot_rankings(orjson.loads(payload))}
+        for album, payload in rows
+    ]
@@ -0,0 +1,118 @@
+from collections import defaultdict
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from .database import Track, Ranking
+import threading
+
+METHODS = ("spearman", "kendall")
+
+
+def load_rankings(session: Session):
+    rows = session.execute(
+        select(Track.album_id, Track.id, Ranking.username, Ranking.placement)
+        .join(Ranking, Ranking.track_id == Track.id)
+        .order_by(Track.album_id, Track.id)
+    ).all()
+    usernames = sorted({username for _, _, username, _ in rows})
+    user_index = {username: i for i, username in enumerate(usernames)}
+    albums = defaultdict(dict)
+    for album_id, track_id, username, placement in rows:
+        albums[album_id].setdefault(track_id, {})[user_index[username]] = placement
+    return usernames, albums
+
+
+# numpy is imported on first use to keep it out of app startup
+def album_tensors(usernames: list[str], albums: dict) -> list:
+    import numpy as np
+
+    # albums with the same track count share one albums x users x tracks tensor
+    groups = defaultdict(list)
+    for tracks in albums.values():
+        matrix = np.full((len(usernames), len(tracks)), np.nan)
+        for column, placements in enumerate(tracks.values()):
+            for row, placement in placements.items():
+                matrix[row, column] = placement
+        groups[len(tracks)].append(matrix)
+    return [np.stack(group) for size, group in groups.items() if size > 1]
+
+
+def correlate(tensor, method: str):
+    import numpy as np
+
+    # users who did not rank every track of an album sit that album out
+    present = ~np.isnan(tensor).any(axis=2)
+    values = np.nan_to_num(tensor)
+    differences = values[..., :, None] - values[..., None, :]
+    if method == "spearman":
+        # average ranks, so tied placements are handled like scipy.stats.rankdata
+        ranks = (differences > 0).sum(axis=3) + ((differences == 0).sum(axis=3) + 1) / 2
+        vectors = ranks - ranks.mean(axis=2, keepdims=True)
+    else:
+        upper = np.triu_indices(tensor.shape[2], k=1)
+        vectors = np.sign(differences[..., upper[0], upper[1]])
+    norms = np.sqrt((vectors**2).sum(axis=2))
+    present &= norms > 0
+    vectors = np.divide(
+        vectors, norms[..., None], out=np.zeros_like(vectors), where=present[..., None]
+    )
+    totals = np.einsum("aui,avi->uv", vectors, vectors)
+    counts = np.einsum("au,av->uv", present.astype(float), present.astype(float))
+    return totals, counts
+
+
+def similarity(usernames: list[str], albums: dict, method: str) -> dict:
+    import numpy as np
+
+    size = len(usernames)
+    totals = np.zeros((size, size))
+    counts = np.zeros((size, size))
+    for tensor in album_tensors(usernames, albums):
+        album_totals, album_counts = correlate(tensor, method)
+        totals += album_totals
+        counts += album_counts
+    means = np.divide(totals, counts, out=np.full_like(totals, np.nan), where=counts > 0)
+    matrix = [
+        [None if np.isnan(value) else round(float(value), 4) for value in row]
+        for row in means
+    ]
+    return {
+        "method": method,
+        "usernames": usernames,
+        "matrix": matrix,
+        "albums": counts.astype(int).tolist(),
+    }
+
+
+class StatsCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._results: dict[str, dict] = {}
+
+    def get(self, version, method: str) -> dict | None:
+        with self._lock:
+            if self._version != version:
+                return None
+            return self._results.get(method)
+
+    def put(self, version, method: str, result: dict):
+        with self._lock:
+            if self._version != version:
+                self._version = version
+                self._results = {}
+            self._results[method] = result
+
+
+stats_cache = StatsCache()
+
+
+def compatibility(result: dict, username: str) -> list[dict]:
+    row = result["usernames"].index(username)
+    matches = [
+        {"username": other, "correlation": correlation, "albums": albums}
+        for other, correlation, albums in zip(
+            result["usernames"], result["matrix"][row], result["albums"][row]
+        )
+        if other != username and correlation is not None
+    ]
+    return sorted(matches, key=lambda d: d["correlation"], reverse=True)
@@ -0,0 +1,18 @@
+import io
+import os
+
+
+# Pillow is imported in the worker that resizes, to keep it out of app startup
+def make_thumbnails(image: bytes, directory: str, sizes: tuple[int, ...]):
+    from PIL import Image
+
+    os.makedirs(directory, exist_ok=True)
+    with Image.open(io.BytesIO(image)) as source:
+        source = source.convert("RGB")
+        for size in sizes:
+            thumbnail = source.copy()
+            thumbnail.thumbnail((size, size), Image.Resampling.LANCZOS)
+            path = os.path.join(directory, f"{size}.jpg")
+            # write then rename so a reader never sees a half-written file
+            thumbnail.save(f"{path}.tmp", "JPEG", quality=85, optimize=True)
+            os.replace(f"{path}.tmp", path)
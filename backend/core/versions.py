@@ -0,0 +1,43 @@
+from fastapi import Request, Response
+import hashlib
+import threading
+import uuid
+
+
+class ResourceVersions:
+    def __init__(self):
+        self._lock = threading.Lock()
+        # keeps ETags from colliding across process restarts
+        self._epoch = uuid.uuid4().hex
+        self._versions: dict[str, int] = {}
+
+    def get(self, key: str) -> int:
+        with self._lock:
+            return self._versions.get(key, 0)
+
+    def bump(self, *keys: str):
+        with self._lock:
+            for key in keys:
+                self._versions[key] = self._versions.get(key, 0) + 1
+
+    def etag(self, *parts) -> str:
+        digest = hashlib.sha1(
+            "|".join(map(str, (self._epoch, *parts))).encode()
+        ).hexdigest()
+        return f'"{digest}"'
+
+
+resource_versions = ResourceVersions()
+
+
+def not_modified(request: Request, response: Response, etag: str) -> Response | None:
+    response.headers["ETag"] = etag
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is None:
+        return None
+    candidates = {
+        candidate.strip().removeprefix("W/") for candidate in if_none_match.split(",")
+    }
+    if etag in candidates or "*" in candidates:
+        return Response(status_code=304, headers={"ETag": etag})
+    return None
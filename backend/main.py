@@ -1,12 +1,32 @@
-from fastapi import FastAPI, Depends, HTTPException, Query
+from fastapi import (
+    FastAPI,
+    APIRouter,
+    BackgroundTasks,
+    Depends,
+    Header,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+)
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from contextlib import asynccontextmanager
+from fastapi.responses import (
+    FileResponse,
+    JSONResponse,
+    ORJSONResponse,
+    PlainTextResponse,
+    StreamingResponse,
+)
+from contextlib import asynccontextmanager, suppress
+from dataclasses import asdict
 from typing import Annotated
 from sqlalchemy.orm import Session
-from sqlalchemy import true, and_, or_, update, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, insert, true, and_, update, func, tuple_
 from .core.database import (
     get_session,
+    write_queue,
+    async_engine,
     create_db_and_tables,
     TelegramSession,
     Config,
@@ -17,8 +37,54 @@ from .core.database import (
     User,
 )
 from .core import schemas
-from .core.api import processUrl
+from .core.api import PROVIDER_WORKERS, fetchUrl
+from .core.auth import (
+    VerifiedSession,
+    new_token,
+    hash_token,
+    optional_session,
+    verified_session,
+    sweep_expired_sessions,
+)
+from .core.provider_cache import cache_stats, purge_entries
+from .core.metrics import MetricsMiddleware, render as render_metrics
+from .core.config_cache import config_cache, ConfigSnapshot
+from .core.rankings import (
+    write_rankings,
+    album_rankings,
+    album_averages,
+    import_rankings,
+)
+from .core.events import event_hub
+from .core.stats import (
+    METHODS,
+    stats_cache,
+    load_rankings,
+    similarity,
+    compatibility,
+)
+from .core.covers import (
+    COVER_SIZES,
+    COVER_MAX_AGE,
+    cache_cover,
+    cover_path,
+    shutdown_pool,
+)
+from .core.search import index_album, search_albums
+from .core.export import FORMATS, export_rows
+from .core.snapshots import snapshot_rounds, closed_rounds, round_results
+from .core.versions import resource_versions, not_modified
+from .core.pagination import (
+    DEFAULT_PAGE_SIZE,
+    MAX_PAGE_SIZE,
+    decode_cursor,
+    paginate,
+)
+from pydantic import ValidationError
 from dotenv import load_dotenv
+import asyncio
+import csv
+import orjson
 import datetime
 import time
 import os
@@ -30,10 +96,20 @@ import uuid
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     create_db_and_tables()
+    write_queue.start()
+    await write_queue.run(snapshot_rounds)
+    sweeper = asyncio.create_task(sweep_expired_sessions())
     yield
+    event_hub.close()
+    sweeper.cancel()
+    with suppress(asyncio.CancelledError):
+        await sweeper
+    shutdown_pool()
+    write_queue.stop()
+    await async_engine.dispose()
 
 
-app = FastAPI(lifespan=lifespan)
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -49,52 +125,97 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
 
 load_dotenv()
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
+# every fetch runs on the provider pool, so more concurrency than it has
+# threads would only queue
+BATCH_CONCURRENCY = min(int(os.getenv("BATCH_CONCURRENCY", "4")), PROVIDER_WORKERS)
 
 
-@app.get("/users/")
-async def get_users(telegram_id: int = None, session: Session = Depends(get_session)):
-    db_users = (
-        session.query(User)
-        .where((User.id == id) if telegram_id is not None else true())
-        .all()
+async def require_admin(
+    verified: Annotated[VerifiedSession, Depends(verified_session)],
+    session: Annotated[AsyncSession, Depends(get_session)],
+):
+    db_user = await session.get(User, verified.telegram_id)
+    if db_user is None or not db_user.admin_rights:
+        raise HTTPException(status_code=403, detail="Недостаточно прав.")
+    return db_user
+
+
+# every admin endpoint is registered here so none can skip the session check
+admin = APIRouter(dependencies=[Depends(require_admin)])
+
+
+@app.get("/users/", response_model=schemas.Page[schemas.UserOut])
+async def get_users(
+    telegram_id: int = None,
+    limit: int = Query(default=DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: str | None = None,
+    session: AsyncSession = Depends(get_session),
+):
+    db_users = select(User).where(
+        (User.id == telegram_id) if telegram_id is not None else true()
     )
-    if len(db_users) == 0:
+    if cursor is not None:
+        (last_id,) = decode_cursor(cursor, 1)
+        db_users = db_users.where(User.id > last_id)
+    db_users = (
+        await session.scalars(db_users.order_by(User.id).limit(limit + 1))
+    ).all()
+    if len(db_users) == 0 and cursor is None:
         raise HTTPException(status_code=404, detail="Пользователи не найдены.")
-    return db_users
+    return paginate(db_users, limit, lambda user: (user.id,))
 
 
-@app.post("/users/")
-async def create_user(user: schemas.User, session: Session = Depends(get_session)):
+@app.post("/users/", response_model=schemas.UserOut)
+async def create_user(
+    user: schemas.User,
+    verified: Annotated[VerifiedSession | None, Depends(optional_session)],
+    session: AsyncSession = Depends(get_session),
+):
+    if user.admin_rights:
+        db_admin = None
+        if verified is not None:
+            db_admin = await session.get(User, verified.telegram_id)
+        if db_admin is None or not db_admin.admin_rights:
+            raise HTTPException(status_code=403, detail="Недостаточно прав.")
     db_user = User(
         id=user.id,
         username=user.username,
         admin_rights=user.admin_rights,
     )
-    if session.query(User).where(User.id == user.id).first() is not None:
+    if await session.get(User, user.id) is not None:
         raise HTTPException(status_code=500, detail="Пользователь уже существует.")
-    session.add(db_user)
-    session.commit()
-    session.refresh(db_user)
+    await write_queue.run(Session.add, db_user)
     return db_user
 
 
-@app.get("/sessions/")
-async def get_sessions(telegram_id: str, session: Session = Depends(get_session)):
-    db_session = (
-        session.query(Session).where(Session.telegram_id == telegram_id).first()
+@app.get("/sessions/", response_model=schemas.SessionOut)
+async def get_sessions(
+    telegram_id: int, session: AsyncSession = Depends(get_session)
+):
+    db_session = await session.scalar(
+        select(TelegramSession)
+        .where(TelegramSession.telegram_id == telegram_id)
+        .order_by(TelegramSession.expires_at.desc())
+        .limit(1)
     )
     if db_session is None:
         raise HTTPException(status_code=404, detail="Сессия не найдена.")
     return db_session
 
 
-@app.post("/sessions/")
-async def create_session(
-    data: schemas.Session, session: Session = Depends(get_session)
+@app.get("/sessions/me", response_model=schemas.SessionOut)
+async def get_current_session(
+    verified: Annotated[VerifiedSession, Depends(verified_session)],
 ):
+    return verified
+
+
+@app.post("/sessions/", response_model=schemas.SessionToken)
+async def create_session(data: schemas.Session):
     check_hash = data.hash
     data_check_arr = []
     for key, value in data:
@@ -107,100 +228,84 @@ async def create_session(
         secret_key, data_check_string.encode(), hashlib.sha256
     ).hexdigest()
 
-    if hash_value != check_hash:
+    if not hmac.compare_digest(hash_value, check_hash):
         raise HTTPException(status_code=403, detail="Данные не из Telegram.")
 
     if (time.time() - data.auth_date) > 86400:
         raise HTTPException(status_code=408, detail="Данные устарели.")
 
-    if session.query(Session).where(Session.telegram_id == data.id).first() is not None:
-        raise HTTPException(status_code=500, detail="Сессия уже существует.")
-    db_session = Session(
+    # every verified sign-in gets a fresh token; it is returned only here
+    token = new_token()
+    db_session = TelegramSession(
         telegram_id=data.id,
+        token_hash=hash_token(token),
         expires_at=(
             datetime.datetime.fromtimestamp(data.auth_date)
             + datetime.timedelta(days=14)
         ),
     )
-    session.add(db_session)
-    session.commit()
-    session.refresh(db_session)
-    return db_session
+    await write_queue.run(Session.add, db_session)
+    return {
+        "token": token,
+        "telegram_id": db_session.telegram_id,
+        "expires_at": db_session.expires_at,
+    }
 
 
-@app.patch("/sessions/")
-async def change_session(
-    data: schemas.SessionPatch, session: Session = Depends(get_session)
-):
-    db_session = (
-        session.query(Session)
-        .where(
-            Session.id == data.id,
-        )
-        .first()
-    )
-    session_update = (
-        update(Session)
-        .where(
-            Session.id == data.id,
-        )
-        .values(
-            expires_at=datetime.datetime.fromtimestamp(data.auth_date)
-            + datetime.timedelta(days=14)
-        )
-    )
-    session.execute(session_update)
-    session.commit()
-    session.refresh(db_session)
-    return db_session
-
-
-@app.get("/albums/")
+@app.get("/albums/", response_model=schemas.Page[schemas.AlbumOut])
 async def get_albums(
-    session: Annotated[Session, Depends(get_session)],
+    request: Request,
+    response: Response,
+    session: Annotated[AsyncSession, Depends(get_session)],
     artist: str | None = None,
     name: str | None = None,
     release_year: int | None = None,
     no_spoilers: bool = False,
+    limit: int = Query(default=DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: str | None = None,
 ):
-    config = session.query(Config).first()
+    etag = resource_versions.etag(
+        resource_versions.get("albums"), config_cache.version, request.url.query
+    )
+    if (cached := not_modified(request, response, etag)) is not None:
+        return cached
+    config = await config_cache.get(session)
     if not config:
         raise HTTPException(status_code=404, detail="Конфиг не найден.")
-    db_albums = session.query(Album).where(
+    db_albums = select(Album).where(
         (Album.artist == artist) if artist is not None else true(),
         (Album.name == name) if name is not None else true(),
         ((Album.release_year == release_year) if release_year is not None else true()),
     )
     if no_spoilers:
-        db_albums = (
-            db_albums.where(
-                (Album.round_number < db_config.current_round),
-            ).all()
-            + db_albums.where(
-                and_(
-                    (Album.order_number < db_config.current_order_number),
-                    (Album.round_number == db_config.current_round),
-                )
-            ).all()
+        # a row-value comparison seeks uix_round_order, where the OR form scanned it
+        db_albums = db_albums.where(
+            tuple_(Album.round_number, Album.order_number)
+            < tuple_(config.current_round, config.current_order_number)
+        )
+    if cursor is not None:
+        round_number, order_number = decode_cursor(cursor, 2)
+        db_albums = db_albums.where(
+            tuple_(Album.round_number, Album.order_number)
+            > tuple_(round_number, order_number)
         )
-    else:
-        db_albums = db_albums.all()
-    if len(db_albums) == 0:
+    db_albums = (
+        await session.scalars(
+            db_albums.order_by(Album.round_number, Album.order_number).limit(
+                limit + 1
+            )
+        )
+    ).all()
+    if len(db_albums) == 0 and cursor is None:
         raise HTTPException(status_code=404, detail="Альбомы не найдены.")
-    return db_albums
+    return paginate(
+        db_albums, limit, lambda album: (album.round_number, album.order_number)
+    )
 
 
-@app.post("/albums/")
-async def create_album(
-    album: schemas.Album,
-    session: Annotated[Session, Depends(get_session)],
+def insert_album(
+    session: Session, config: ConfigSnapshot, username: str, requested_album: dict
 ):
-    config = session.query(Config).first()
-    if not config:
-        raise HTTPException(status_code=404, detail="Конфиг не найден.")
-    if not config.submissions_open:
-        raise HTTPException(status_code=500, detail="Отправка альбомов закрыта")
-    requested_album = processUrl(album.source, album.url)
     artist = requested_album["artist"]
     name = requested_album["name"]
     release_year = requested_album["release_year"]
@@ -210,22 +315,24 @@ async def create_album(
     for key in ("artist", "name", "release_year", "total_tracks", "duration", "cover"):
         requested_album.pop(key, None)
     tracks = list(requested_album.values())
-    q = session.query(Album)
-    if q.where(and_(Album.artist == artist, Album.name == name)).first() is not None:
+    if (
+        session.scalar(
+            select(Album.id).where(Album.artist == artist, Album.name == name).limit(1)
+        )
+        is not None
+    ):
         raise HTTPException(status_code=500, detail="Альбом уже был на круге")
     if (
-        q.where(
-            or_(
-                and_(
-                    Album.round_number == config.current_round - 1,
-                    Album.artist == artist,
-                ),
-                and_(
-                    Album.round_number == config.current_round,
-                    Album.artist == artist,
+        session.scalar(
+            select(Album.id)
+            .where(
+                Album.artist == artist,
+                Album.round_number.in_(
+                    (config.current_round - 1, config.current_round)
                 ),
             )
-        ).first()
+            .limit(1)
+        )
         is not None
     ):
         raise HTTPException(
@@ -240,244 +347,346 @@ async def create_album(
         raise HTTPException(
             status_code=500, detail="Длина альбома превышает разрешённую"
         )
-    if (
-        len(
-            session.query(UserAlbumSubmission)
-            .join(
-                Album,
-                and_(
-                    UserAlbumSubmission.album_id == Album.id,
-                    Album.round_number == config.current_round,
-                ),
-            )
-            .where(UserAlbumSubmission.username == album.username)
-            .all()
+    submissions = session.scalar(
+        select(func.count(UserAlbumSubmission.id))
+        .join(Album, UserAlbumSubmission.album_id == Album.id)
+        .where(
+            UserAlbumSubmission.username == username,
+            Album.round_number == config.current_round,
         )
-        == config.max_submissions
-    ):
+    )
+    if submissions >= config.max_submissions:
         raise HTTPException(
             status_code=500,
             detail="Этот пользователь уже отправил максимальное количество альбомов",
         )
-    round_albums = q.where(Album.round_number == config.current_round).all()
-    db_album = Album(
-        artist=artist,
-        name=name,
-        duration=duration,
-        total_tracks=total_tracks,
-        release_year=release_year,
-        round_number=config.current_round,
-        cover=cover,
-        order_number=(
-            (round_albums[-1].order_number + 1) if len(round_albums) != 0 else 1
-        ),
+    # the next order number is read inside the INSERT itself, so two
+    # submissions can never both claim it under uix_round_order
+    next_order_number = (
+        select(func.coalesce(func.max(Album.order_number), 0) + 1)
+        .where(Album.round_number == config.current_round)
+        .scalar_subquery()
     )
-    session.add(db_album)
-    session.commit()
-    album_id = (
-        session.query(Album)
-        .where(Album.artist == artist, Album.name == name)
-        .first()
-        .id
+    db_album = session.scalar(
+        insert(Album)
+        .values(
+            artist=artist,
+            name=name,
+            duration=duration,
+            total_tracks=total_tracks,
+            release_year=release_year,
+            round_number=config.current_round,
+            cover=cover,
+            order_number=next_order_number,
+        )
+        .returning(Album)
     )
-    db_tracks = []
-    for track_name in requested_album.values():
-        db_tracks.append(Track(track_name=track_name, album_id=album_id))
-    session.add_all(db_tracks)
-    session.commit()
-    userSubmission = UserAlbumSubmission(
-        username=album.username,
-        album_id=(
-            session.query(Album)
-            .where(Album.artist == artist, Album.name == name)
-            .first()
-            .id
-        ),
+    session.execute(
+        insert(Track),
+        [{"track_name": track_name, "album_id": db_album.id} for track_name in tracks],
     )
-    session.add(userSubmission)
-    session.commit()
-    session.refresh(db_album)
+    session.add(UserAlbumSubmission(username=username, album_id=db_album.id))
+    session.flush()
+    index_album(session, db_album.id, artist, name, tracks)
     return db_album
 
 
-@app.get("/albums/{album_id}")
-async def get_album(album_id: int, session: Annotated[Session, Depends(get_session)]):
-    db_album = session.query(Album).where(Album.id == album_id).first()
+@app.get("/search", response_model=list[schemas.SearchResult])
+async def search(
+    q: str,
+    request: Request,
+    response: Response,
+    session: Annotated[AsyncSession, Depends(get_session)],
+    limit: int = Query(default=20, ge=1, le=100),
+):
+    etag = resource_versions.etag(
+        resource_versions.get("albums"), request.url.query
+    )
+    if (cached := not_modified(request, response, etag)) is not None:
+        return cached
+    return await session.run_sync(search_albums, q, limit)
+
+
+@app.post("/albums/", response_model=schemas.AlbumOut)
+async def create_album(
+    album: schemas.Album,
+    session: Annotated[AsyncSession, Depends(get_session)],
+    background_tasks: BackgroundTasks,
+):
+    config = await config_cache.get(session)
+    if not config:
+        raise HTTPException(status_code=404, detail="Конфиг не найден.")
+    if not config.submissions_open:
+        raise HTTPException(status_code=500, detail="Отправка альбомов закрыта")
+    try:
+        requested_album = await fetchUrl(album.source, album.url)
+    except asyncio.TimeoutError:
+        raise HTTPException(
+            status_code=504, detail="Сервис с информацией об альбоме не ответил."
+        )
+    db_album = await write_queue.run(
+        insert_album, config, album.username, requested_album
+    )
+    resource_versions.bump("albums")
+    event_hub.publish("album", album_event(db_album))
+    background_tasks.add_task(cache_cover, db_album.id, db_album.cover)
+    return db_album
+
+
+@admin.post("/albums/batch/", response_model=list[schemas.AlbumImportResult])
+async def create_albums(
+    albums: list[schemas.Album],
+    session: Annotated[AsyncSession, Depends(get_session)],
+    background_tasks: BackgroundTasks,
+    concurrency: int = Query(default=BATCH_CONCURRENCY, ge=1, le=PROVIDER_WORKERS),
+):
+    config = await config_cache.get(session)
+    if not config:
+        raise HTTPException(status_code=404, detail="Конфиг не найден.")
+    if not config.submissions_open:
+        raise HTTPException(status_code=500, detail="Отправка альбомов закрыта")
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch(album: schemas.Album):
+        async with semaphore:
+            return await fetchUrl(album.source, album.url)
+
+    requested_albums = await asyncio.gather(
+        *(fetch(album) for album in albums), return_exceptions=True
+    )
+
+    def insert_albums(session: Session):
+        results = []
+        for album, requested_album in zip(albums, requested_albums):
+            result = {"url": album.url, "success": False}
+            if isinstance(requested_album, asyncio.TimeoutError):
+                result.update(
+                    status_code=504,
+                    detail="Сервис с информацией об альбоме не ответил.",
+                )
+            elif isinstance(requested_album, Exception):
+                result.update(
+                    status_code=502,
+                    detail="Не удалось получить информацию об альбоме.",
+                )
+            else:
+                try:
+                    db_album = insert_album(
+                        session, config, album.username, requested_album
+                    )
+                    result.update(success=True, status_code=200, album=db_album)
+                except HTTPException as e:
+                    result.update(status_code=e.status_code, detail=e.detail)
+            results.append(result)
+        return results
+
+    results = await write_queue.run(insert_albums)
+    resource_versions.bump("albums")
+    for result in results:
+        if result["success"]:
+            event_hub.publish("album", album_event(result["album"]))
+            background_tasks.add_task(
+                cache_cover, result["album"].id, result["album"].cover
+            )
+    return results
+
+
+@app.get("/albums/{album_id}", response_model=schemas.AlbumOut)
+async def get_album(
+    album_id: int,
+    request: Request,
+    response: Response,
+    session: Annotated[AsyncSession, Depends(get_session)],
+):
+    etag = resource_versions.etag(resource_versions.get("albums"), album_id)
+    if (cached := not_modified(request, response, etag)) is not None:
+        return cached
+    db_album = await session.get(Album, album_id)
     if not db_album:
         raise HTTPException(status_code=404, detail="Альбом не найден.")
     return db_album
 
 
-@app.post("/albums/{album_id}")
+@app.post("/albums/{album_id}", response_model=schemas.AlbumOut)
 async def create_ranking(
     album_id: int,
     ranking: schemas.Ranking,
-    session: Annotated[Session, Depends(get_session)],
+    session: Annotated[AsyncSession, Depends(get_session)],
 ):
-    db_album = session.query(Album).where(Album.id == album_id).first()
-    tracks = session.query(Track).where(Track.album_id == album_id).all()
-    db_rankings = []
-    if len(tracks) == 0:
-        raise HTTPException(status_code=404, detail="Альбом не найден.")
-    if len(tracks) != len(ranking.placements):
-        raise HTTPException(
-            status_code=400,
-            detail="Количество позиций не равно количеству треков в альбоме.",
-        )
-    if (
-        session.query(Ranking)
-        .where(
-            and_(
-                Ranking.username == ranking.username,
-                Ranking.track_id == tracks[0].id,
-            )
-        )
-        .first()
-        is not None
-    ):
-        raise HTTPException(
-            status_code=400,
-            detail="У этого пользователя уже есть оценки.",
-        )
-    for i in range(len(ranking.placements)):
-        db_ranking = Ranking(
-            username=ranking.username,
-            track_id=tracks[i].id,
-            placement=ranking.placements[i],
-        )
-        db_rankings.append(db_ranking)
-    session.add_all(db_rankings)
-    session.commit()
-    session.refresh(db_album)
-    return db_album
+    await write_queue.run(
+        write_rankings, album_id, ranking.username, ranking.placements
+    )
+    resource_versions.bump("rankings", f"rankings:{album_id}")
+    event_hub.publish(
+        "ranking",
+        {
+            "album_id": album_id,
+            "username": ranking.username,
+            "placements": ranking.placements,
+            "averages": await session.run_sync(album_averages, album_id),
+        },
+    )
+    return await session.get(Album, album_id)
 
 
-@app.patch("/albums/{album_id}")
+@app.patch("/albums/{album_id}", response_model=schemas.AlbumOut)
 async def change_ranking(
     album_id: int,
     ranking: schemas.Ranking,
-    session: Annotated[Session, Depends(get_session)],
+    session: Annotated[AsyncSession, Depends(get_session)],
 ):
-    db_album = session.query(Album).where(Album.id == album_id).first()
-    tracks = session.query(Track).where(Track.album_id == album_id).all()
-    for i in range(len(ranking.placements)):
-        db_ranking = (
-            session.query(Ranking)
-            .where(
-                and_(
-                    Ranking.track_id == tracks[i].id,
-                    Ranking.username == ranking.username,
-                )
-            )
-            .first()
+    await write_queue.run(
+        write_rankings, album_id, ranking.username, ranking.placements, True
+    )
+    resource_versions.bump("rankings", f"rankings:{album_id}")
+    event_hub.publish(
+        "ranking",
+        {
+            "album_id": album_id,
+            "username": ranking.username,
+            "placements": ranking.placements,
+            "averages": await session.run_sync(album_averages, album_id),
+        },
+    )
+    return await session.get(Album, album_id)
+
+
+@admin.post("/rankings/import/", response_model=schemas.RankingImportResult)
+async def import_album_rankings(
+    request: Request, session: Annotated[AsyncSession, Depends(get_session)]
+):
+    body = await request.body()
+    try:
+        if request.headers.get("content-type", "").startswith("text/csv"):
+            raw_rows = list(csv.DictReader(body.decode("utf-8-sig").splitlines()))
+        else:
+            raw_rows = orjson.loads(body)
+    except (UnicodeDecodeError, orjson.JSONDecodeError):
+        raise HTTPException(status_code=400, detail="Не удалось прочитать файл.")
+    if not isinstance(raw_rows, list):
+        raise HTTPException(status_code=400, detail="Ожидался список оценок.")
+    rows = []
+    rejected = []
+    for number, raw_row in enumerate(raw_rows, start=1):
+        try:
+            rows.append((number, schemas.RankingRow.model_validate(raw_row)))
+        except ValidationError:
+            rejected.append({"row": number, "detail": "Неверная строка."})
+    inserted, db_rejected, album_ids = await write_queue.run(
+        import_rankings, [row.model_dump() for _, row in rows]
+    )
+    # import_rankings numbers the rows it was given; map back to the upload
+    for reject in db_rejected:
+        reject["row"] = rows[reject["row"] - 1][0]
+    if inserted:
+        resource_versions.bump(
+            "rankings", *(f"rankings:{album_id}" for album_id in album_ids)
         )
-        ranking_update = (
-            update(Ranking)
-            .where(
-                and_(
-                    Ranking.username == ranking.username,
-                    Ranking.track_id == tracks[i].id,
-                )
+        for album_id in sorted(album_ids):
+            event_hub.publish(
+                "ranking",
+                {
+                    "album_id": album_id,
+                    "averages": await session.run_sync(album_averages, album_id),
+                },
             )
-            .values(placement=ranking.placements[i])
-        )
-        session.execute(ranking_update)
-    session.commit()
-    session.refresh(db_album)
-    return db_album
+    return {
+        "inserted": inserted,
+        "rejected": sorted(rejected + db_rejected, key=lambda d: d["row"]),
+    }
 
 
-@app.get("/tracks/")
+@app.get("/tracks/", response_model=list[schemas.TrackOut])
 async def get_tracks(
-    session: Annotated[Session, Depends(get_session)],
+    session: Annotated[AsyncSession, Depends(get_session)],
     track_name: str | None = None,
 ):
-    config = session.query(Config).first()
+    config = await config_cache.get(session)
     if not config:
         raise HTTPException(status_code=404, detail="Конфиг не найден.")
-    db_album = (
-        session.query(Album)
-        .where(
+    db_album = await session.scalar(
+        select(Album).where(
             and_(
                 Album.round_number == config.current_round,
                 Album.order_number == config.current_order_number,
             )
         )
-        .first()
     )
     if not db_album:
         raise HTTPException(status_code=404, detail="Оценивание недоступно.")
     m = Track
     db_tracks = (
-        session.query(m)
-        .where(
-            (m.track_name == track_name) if track_name is not None else true(),
-            (m.album_id == db_album.id),
+        await session.scalars(
+            select(m).where(
+                (m.track_name == track_name) if track_name is not None else true(),
+                (m.album_id == db_album.id),
+            )
         )
-        .all()
-    )
+    ).all()
     if len(db_tracks) == 0:
         raise HTTPException(status_code=404, detail="Треки не найдены.")
     return db_tracks
 
 
-@app.get("/tracks/{track_id}")
+@app.get("/tracks/{track_id}", response_model=schemas.Page[schemas.RankingOut])
 async def get_track_rankings(
-    session: Annotated[Session, Depends(get_session)],
+    session: Annotated[AsyncSession, Depends(get_session)],
     track_id: int,
     username: str | None = None,
+    limit: int = Query(default=DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: str | None = None,
 ):
-    db_rankings = (
-        session.query(Ranking)
-        .where(
-            Ranking.track_id == track_id,
-            (Ranking.username == username) if username is not None else true(),
-        )
-        .all()
+    db_rankings = select(Ranking).where(
+        Ranking.track_id == track_id,
+        (Ranking.username == username) if username is not None else true(),
     )
-    if len(db_rankings) == 0:
+    if cursor is not None:
+        (last_id,) = decode_cursor(cursor, 1)
+        db_rankings = db_rankings.where(Ranking.id > last_id)
+    db_rankings = (
+        await session.scalars(db_rankings.order_by(Ranking.id).limit(limit + 1))
+    ).all()
+    if len(db_rankings) == 0 and cursor is None:
         raise HTTPException(status_code=404, detail="Оценки не найдены.")
-    return db_rankings
+    return paginate(db_rankings, limit, lambda ranking: (ranking.id,))
 
 
-@app.get("/rankings/{album_id}")
+@app.get("/rankings/{album_id}", response_model=list[schemas.TrackRankings])
 async def get_album_rankings(
-    album_id: int, session: Annotated[Session, Depends(get_session)]
+    album_id: int,
+    request: Request,
+    response: Response,
+    session: Annotated[AsyncSession, Depends(get_session)],
 ):
-    db_tracks = session.query(Track).where(Track.album_id == album_id).all()
-    if not session.query(Ranking).where(Ranking.track_id == db_tracks[0].id).first():
+    etag = resource_versions.etag(
+        resource_versions.get(f"rankings:{album_id}"), album_id
+    )
+    if (cached := not_modified(request, response, etag)) is not None:
+        return cached
+    db_rankings = await session.run_sync(album_rankings, album_id)
+    if len(db_rankings) == 0:
         raise HTTPException(status_code=404, detail="У альбома нет ранкингов.")
-    db_rankings = []
-    for track in db_tracks:
-        rankings = []
-        i = 0
-        for ranking in session.query(Ranking).where(Ranking.track_id == track.id).all():
-            rankings.append(
-                {"username": ranking.username, "placement": ranking.placement}
-            )
-            i += 1
-        placements = [dict["placement"] for dict in rankings]
-        db_rankings.append(
-            {
-                "track_name": track.track_name,
-                "rankings": rankings,
-                "placement": round(sum(placements) / len(placements) * 100) / 100,
-            }
-        )
-    return sorted(db_rankings, key=lambda d: d["placement"])
+    return db_rankings
 
 
-@app.get("/config/")
-async def get_config(session: Annotated[Session, Depends(get_session)]):
-    return session.query(Config).first()
+@app.get("/config/", response_model=schemas.ConfigOut | None)
+async def get_config(session: Annotated[AsyncSession, Depends(get_session)]):
+    return await config_cache.get(session)
 
 
-@app.patch("/config/")
-async def change_config(
-    config: schemas.Config,
-    session: Annotated[Session, Depends(get_session)],
-):
-    db_config = session.query(Config).first()
+def album_event(db_album: Album) -> dict:
+    return {
+        "id": db_album.id,
+        "artist": db_album.artist,
+        "name": db_album.name,
+        "round_number": db_album.round_number,
+        "order_number": db_album.order_number,
+    }
+
+
+def update_config(session: Session, config: schemas.Config):
+    db_config = session.scalar(select(Config).limit(1))
+    previous_round = db_config.current_round
     session.execute(
         update(Config),
         [
@@ -521,6 +730,150 @@ async def change_config(
             }
         ],
     )
-    session.commit()
     session.refresh(db_config)
+    if db_config.current_round != previous_round:
+        snapshot_rounds(session)
     return db_config
+
+
+@app.patch("/config/", response_model=schemas.ConfigOut)
+async def change_config(
+    config: schemas.Config, session: Annotated[AsyncSession, Depends(get_session)]
+):
+    previous = await config_cache.get(session)
+    db_config = await write_queue.run(update_config, config)
+    current = config_cache.refresh(db_config)
+    if config.current_round is not None:
+        resource_versions.bump("rounds")
+    changes = {
+        key: value
+        for key, value in asdict(current).items()
+        if previous is None or getattr(previous, key) != value
+    }
+    if changes:
+        event_hub.publish("config", changes)
+    return db_config
+
+
+@app.get("/events", response_class=StreamingResponse)
+async def get_events(last_event_id: Annotated[int | None, Header()] = None):
+    return StreamingResponse(
+        event_hub.stream(last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/rounds/", response_model=list[schemas.RoundSummary])
+async def get_rounds(
+    request: Request,
+    response: Response,
+    session: Annotated[AsyncSession, Depends(get_session)],
+):
+    etag = resource_versions.etag(resource_versions.get("rounds"))
+    if (cached := not_modified(request, response, etag)) is not None:
+        return cached
+    return await session.run_sync(closed_rounds)
+
+
+async def ranking_similarity(session: AsyncSession, method: str) -> dict:
+    if method not in METHODS:
+        raise HTTPException(status_code=400, detail="Неизвестный метод.")
+    version = resource_versions.get("rankings")
+    result = stats_cache.get(version, method)
+    if result is None:
+        usernames, albums = await session.run_sync(load_rankings)
+        result = await asyncio.to_thread(similarity, usernames, albums, method)
+        stats_cache.put(version, method, result)
+    return result
+
+
+@app.get("/stats/similarity", response_model=schemas.Similarity)
+async def get_similarity(
+    request: Request,
+    response: Response,
+    session: Annotated[AsyncSession, Depends(get_session)],
+    method: str = "spearman",
+):
+    etag = resource_versions.etag(resource_versions.get("rankings"), method)
+    if (cached := not_modified(request, response, etag)) is not None:
+        return cached
+    return await ranking_similarity(session, method)
+
+
+@app.get("/stats/compatibility/{username}", response_model=list[schemas.Compatibility])
+async def get_compatibility(
+    username: str,
+    request: Request,
+    response: Response,
+    session: Annotated[AsyncSession, Depends(get_session)],
+    method: str = "spearman",
+):
+    etag = resource_versions.etag(
+        resource_versions.get("rankings"), method, username
+    )
+    if (cached := not_modified(request, response, etag)) is not None:
+        return cached
+    result = await ranking_similarity(session, method)
+    if username not in result["usernames"]:
+        raise HTTPException(status_code=404, detail="Оценки не найдены.")
+    return compatibility(result, username)
+
+
+@app.get("/rounds/{round_number}", response_model=list[schemas.RoundResults])
+async def get_round(
+    round_number: int,
+    request: Request,
+    response: Response,
+    session: Annotated[AsyncSession, Depends(get_session)],
+):
+    etag = resource_versions.etag(resource_versions.get("rounds"), round_number)
+    if (cached := not_modified(request, response, etag)) is not None:
+        return cached
+    db_results = await session.run_sync(round_results, round_number)
+    if len(db_results) == 0:
+        raise HTTPException(status_code=404, detail="Итоги круга не найдены.")
+    return db_results
+
+
+@app.get("/covers/{album_id}/{size}", response_class=FileResponse)
+async def get_cover(album_id: int, size: int):
+    path = cover_path(album_id, size)
+    if size not in COVER_SIZES or not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Обложка не найдена.")
+    return FileResponse(
+        path,
+        media_type="image/jpeg",
+        headers={"Cache-Control": f"public, max-age={COVER_MAX_AGE}, immutable"},
+    )
+
+
+@app.get("/export/rankings", response_class=StreamingResponse)
+async def export_rankings(format: str = "ndjson"):
+    if format not in FORMATS:
+        raise HTTPException(status_code=400, detail="Неизвестный формат.")
+    return StreamingResponse(
+        export_rows(format),
+        media_type=FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="rankings.{format}"'},
+    )
+
+
+@admin.get("/cache/providers/", response_model=schemas.ProviderCacheStats)
+async def get_provider_cache(session: AsyncSession = Depends(get_session)):
+    return await session.run_sync(cache_stats)
+
+
+@admin.delete("/cache/providers/", response_model=schemas.PurgeResult)
+async def purge_provider_cache(key: str | None = None):
+    return {"purged": await write_queue.run(purge_entries, key)}
+
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def get_metrics():
+    return PlainTextResponse(
+        render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+app.include_router(admin)
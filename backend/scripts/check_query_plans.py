@@ -0,0 +1,241 @@
+import datetime
+import hashlib
+import hmac
+import io
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+from contextlib import contextmanager
+
+# Tables that may be scanned anywhere: config only ever holds one row.
+SINGLETON_TABLES = {"config"}
+
+# Intended scans, by name. exercise() wraps the requests that make them in
+# intended(name); the same statement issued anywhere else still fails.
+INTENDED_SCANS = {
+    "album listing": "albums",  # unfiltered pages walk uix_round_order to LIMIT
+    "user listing": "users",  # unfiltered pages walk the primary key to LIMIT
+    "search": "album_search",  # MATCH is answered by the FTS5 index
+    "round summary": "round_snapshots",  # counts the frozen albums of every round
+    "statistics": "tracks",  # similarity is computed over every ranking
+    "export": "albums",  # streams every ranking
+    "provider cache stats": "provider_cache",  # counts every entry
+    # finds entries past PROVIDER_CACHE_SIZE, at most that many index entries
+    "provider cache eviction": "provider_cache",
+}
+
+allowed: set[str] = set()
+
+users = ["Joosenitsa", "Aze", "nika", "oqua"]
+
+
+def stub_album(url: str):
+    number = int(re.findall(r"(\d+)$", url)[0])
+    tracklist = {
+        "artist": f"Artist {number}",
+        "name": f"Album {number}",
+        "release_year": 2000 + number,
+        "total_tracks": 8,
+        "cover": f"https://example.com/{number}.jpg",
+    }
+    for i in range(1, 9):
+        tracklist[i] = f"Track {number}-{i}"
+    tracklist["duration"] = datetime.time(minute=40)
+    return tracklist
+
+
+def stub_cover(url: str) -> bytes:
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.new("RGB", (640, 640), (len(url) * 7 % 256, 96, 160)).save(buffer, "JPEG")
+    return buffer.getvalue()
+
+
+def sign_in(client, telegram_id: int, username: str) -> dict:
+    data = {
+        "id": telegram_id,
+        "first_name": username,
+        "username": username,
+        "photo_url": "https://example.com/photo.jpg",
+        "auth_date": int(datetime.datetime.now().timestamp()),
+    }
+    data_check_string = "\n".join(sorted(f"{k}={v}" for k, v in data.items()))
+    secret_key = hashlib.sha256(os.environ["TELEGRAM_TOKEN"].encode()).digest()
+    data["hash"] = hmac.new(
+        secret_key, data_check_string.encode(), hashlib.sha256
+    ).hexdigest()
+    token = client.post("/sessions/", json=data).json()["token"]
+    return {"X-Session-Token": token}
+
+
+@contextmanager
+def intended(*names: str):
+    allowed.update(names)
+    try:
+        yield
+    finally:
+        allowed.difference_update(names)
+
+
+def exercise(client):
+    from ..core.auth import purge_expired_sessions
+    from ..core.database import write_queue
+
+    admin = sign_in(client, 1420576606, "Joosenitsa")
+    client.get("/sessions/me", headers=admin)
+    client.get("/sessions/", params={"telegram_id": 1420576606})
+    client.patch("/config/", json={"submissions_open": True})
+    with intended("provider cache eviction"):
+        for number, username in enumerate(users, start=1):
+            client.post(
+                "/albums/",
+                json={
+                    "source": "spotify",
+                    "url": f"https://open.spotify.com/album/{number}",
+                    "username": username,
+                },
+            )
+        client.post(
+            "/albums/batch/",
+            headers=admin,
+            json=[
+                {
+                    "source": "spotify",
+                    "url": f"https://open.spotify.com/album/{number}",
+                    "username": "Joosenitsa",
+                }
+                for number in (1, 5)
+            ],
+        )
+    for username in users:
+        client.post(
+            "/albums/1", json={"username": username, "placements": list(range(1, 9))}
+        )
+    client.patch(
+        "/albums/1", json={"username": "Aze", "placements": list(range(8, 0, -1))}
+    )
+    client.post(
+        "/rankings/import/",
+        headers=admin,
+        json=[
+            {"username": "Joosenitsa", "track_id": track_id, "placement": track_id - 8}
+            for track_id in range(9, 17)
+        ],
+    )
+    client.patch("/config/", json={"current_order_number": 2})
+    with intended("album listing"):
+        client.get("/albums/")
+    client.get("/albums/", params={"artist": "Artist 1"})
+    client.get("/albums/", params={"artist": "Artist 1", "name": "Album 1"})
+    client.get("/albums/", params={"name": "Album 1"})
+    client.get("/albums/", params={"release_year": 2001})
+    client.get("/albums/", params={"no_spoilers": True})
+    with intended("album listing"):
+        next_cursor = client.get("/albums/", params={"limit": 2}).json()["next_cursor"]
+    client.get("/albums/", params={"limit": 2, "cursor": next_cursor})
+    client.get(
+        "/albums/", params={"artist": "Artist 1", "limit": 2, "cursor": next_cursor}
+    )
+    client.get("/albums/1")
+    client.get("/covers/1/300")
+    with intended("search"):
+        client.get("/search", params={"q": "track 2"})
+    client.get("/tracks/")
+    client.get("/tracks/", params={"track_name": "Track 2-1"})
+    client.get("/tracks/1")
+    client.get("/tracks/1", params={"username": "Aze"})
+    next_cursor = client.get("/tracks/1", params={"limit": 2}).json()["next_cursor"]
+    client.get("/tracks/1", params={"limit": 2, "cursor": next_cursor})
+    client.get("/rankings/1")
+    client.get("/config/")
+    with intended("user listing"):
+        client.get("/users/")
+        next_cursor = client.get("/users/", params={"limit": 2}).json()["next_cursor"]
+    client.get("/users/", params={"limit": 2, "cursor": next_cursor})
+    client.get("/users/", params={"telegram_id": 1420576606})
+    client.patch("/config/", json={"current_round": 2})
+    with intended("round summary"):
+        client.get("/rounds/")
+    client.get("/rounds/1")
+    with intended("statistics"):
+        client.get("/stats/similarity")
+    with intended("export"):
+        client.get("/export/rankings")
+    with intended("statistics"):
+        client.get("/stats/compatibility/Aze", params={"method": "kendall"})
+    with intended("provider cache stats"):
+        client.get("/cache/providers/", headers=admin)
+    client.delete("/cache/providers/", headers=admin, params={"key": "spotify:1"})
+    write_queue.submit(purge_expired_sessions, datetime.datetime.now(), 500).result()
+
+
+def full_scans(plan: list, names: set[str]) -> list[str]:
+    tables = SINGLETON_TABLES | {INTENDED_SCANS[name] for name in names}
+    scans = []
+    for row in plan:
+        # only SEARCH rows seek; any SCAN walks a table or a whole index
+        match = re.match(r"SCAN (\w+)", row[3])
+        if (
+            match
+            and not re.match(r"SCAN (\d+ )?CONSTANT ROWS?$", row[3])
+            and match.group(1) not in tables
+        ):
+            scans.append(row[3])
+    return scans
+
+
+def main():
+    os.chdir(tempfile.mkdtemp())
+    os.environ.setdefault("TELEGRAM_TOKEN", "offline")
+
+    from fastapi.testclient import TestClient
+    from sqlalchemy import event
+    from ..core import api, covers
+    from ..core.database import engine, async_engine, db_path
+    from .. import main as app_module
+
+    api.processSpotify = stub_album
+    covers.fetcher = stub_cover
+    statements = {}
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(
+            ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH")
+        ):
+            if statement in statements:
+                # a statement only keeps the exceptions every issuer declared
+                statements[statement][1].intersection_update(allowed)
+            else:
+                statements[statement] = (
+                    parameters[0] if executemany else parameters,
+                    set(allowed),
+                )
+
+    engines = (engine, async_engine.sync_engine)
+    with TestClient(app_module.app) as client:
+        for target in engines:
+            event.listen(target, "before_cursor_execute", record)
+        exercise(client)
+        for target in engines:
+            event.remove(target, "before_cursor_execute", record)
+
+    connection = sqlite3.connect(db_path)
+    failures = 0
+    for statement, (parameters, names) in statements.items():
+        plan = connection.execute(
+            f"EXPLAIN QUERY PLAN {statement}", parameters
+        ).fetchall()
+        scans = full_scans(plan, names)
+        if scans:
+            failures += 1
+            print(f"FULL SCAN ({', '.join(scans)}):\n{statement}\n")
+    connection.close()
+    print(f"{len(statements)} statements checked, {failures} with full table scans.")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,13 @@
+from ..core.database import SessionLocal, create_db_and_tables
+from ..core.rankings import recompute_aggregates
+
+
+def main():
+    create_db_and_tables()
+    with SessionLocal() as session:
+        recompute_aggregates(session)
+        session.commit()
+
+
+if __name__ == "__main__":
+    main()
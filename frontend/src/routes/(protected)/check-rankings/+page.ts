@@ -3,9 +3,18 @@ import type { PageLoad } from "../../$types"
 export const load: PageLoad = async ({ }) => {
     async function getAlbums(): Promise<string[] | string> {
         try {
-            const response = await fetch('http://127.0.0.1:8000/albums/');
-            const json = await response.json();
-            return response.ok ? (json as string[]) : (json.detail as string);
+            const albums: string[] = [];
+            let cursor: string | null = null;
+            do {
+                const response = await fetch('http://127.0.0.1:8000/albums/' + (cursor ? '?cursor=' + cursor : ''));
+                const json = await response.json();
+                if (!response.ok) {
+                    return json.detail as string;
+                }
+                albums.push(...(json.items as string[]));
+                cursor = json.next_cursor;
+            } while (cursor);
+            return albums;
         } catch (error) {
             return "Что-то пошло не так.";
         }